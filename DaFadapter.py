@@ -0,0 +1,82 @@
+'''
+    DaFup bluetooth adapters: enumeration and load balancing.
+
+    Author: Vic <vicpt[at]protonmail.com>
+    Copyright (C) 2024 Vic
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+import os
+import re
+
+
+''' Where Linux lists the HCI adapters '''
+SYSFS = "/sys/class/bluetooth"
+
+''' Weight of the newest upload rate in an adapter's average '''
+SMOOTH = 0.3
+
+
+''' Local HCI adapters, e.g. ["hci0", "hci1"], empty when unknown '''
+def Adapters():
+    try:
+        names = os.listdir(SYSFS)
+    except OSError:
+        return []
+    # hci0:1 like entries are connections, not adapters
+    return sorted((n for n in names if re.fullmatch(r"hci\d+", n)), key=lambda n: int(n[3:]))
+
+
+''' Keyword arguments binding a BleakClient or BleakScanner to an adapter,
+    None keeps the default one. Only BlueZ picks adapters, through its
+    backend arguments since bleak 3.
+'''
+def AdapterArgs(adapter=None):
+    return {"bluez": {"adapter": adapter}} if adapter else {}
+
+
+''' Adapter load balancer
+
+    Picks the adapter expected to finish a new upload soonest: the fewest
+    uploads running or queued on it per measured bytes/s. Adapters never
+    measured count as fast as the best one, so each gets tried.
+'''
+class Balancer:
+
+    def __init__(self, adapters=()):
+        self.adapters = list(adapters) or [None]
+        self.active   = dict.fromkeys(self.adapters, 0)
+        self.rates    = {}
+
+    ''' Adapter for the next upload '''
+    def Pick(self):
+        return min(self.adapters, key=lambda a: (self.active[a] + 1) / self.Rate(a))
+
+    ''' Measured bytes/s of an adapter '''
+    def Rate(self, adapter):
+        return self.rates.get(adapter) or max(self.rates.values(), default=1)
+
+    ''' An upload was assigned to the adapter '''
+    def Start(self, adapter):
+        if (adapter not in self.active):
+            self.adapters.append(adapter)
+            self.active[adapter] = 0
+        self.active[adapter] += 1
+
+    ''' An upload on the adapter ended, at rate bytes/s if it succeeded '''
+    def Done(self, adapter, rate=0):
+        self.active[adapter] -= 1
+        if (rate <= 0): return
+        old = self.rates.get(adapter)
+        self.rates[adapter] = rate if old is None else SMOOTH * rate + (1 - SMOOTH) * old
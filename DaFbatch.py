@@ -0,0 +1,143 @@
+'''
+    DaFup batch scheduler, uploads one payload to several watches at once.
+
+    Author: Vic <vicpt[at]protonmail.com>
+    Copyright (C) 2024 Vic
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+import time
+import asyncio
+from DaFcore import Upload, UploadError
+from DaFadapter import Balancer
+
+
+''' Batch defaults '''
+LIMIT   = 4   # Concurrent connections per adapter
+RETRIES = 2   # Retries per device after a failed upload
+BACKOFF = 2.0 # First retry delay (seconds), doubled on each retry
+
+
+''' Batch upload scheduler
+
+    Runs one Upload per device on the running event loop, at most `limit`
+    connected at a time on each adapter, retrying failed devices with an
+    exponential backoff. Given a Session, its links are used and kept.
+    Devices pinned to an adapter use it, the others are balanced across
+    `adapters` on every attempt.
+'''
+class Batch:
+
+    def __init__(self, devices, payload, background=False, probe=False,
+                 limit=LIMIT, retries=RETRIES, backoff=BACKOFF,
+                 progress=None, status=None, session=None, force=False,
+                 adapters=(), balancer=None):
+        # devices: list of (address, name) or (address, name, adapter)
+        self.devices    = devices
+        self.payload    = payload
+        self.background = background
+        self.probe      = probe
+        self.limit      = max(1, limit)
+        self.retries    = retries
+        self.backoff    = backoff
+        self.progress   = progress
+        self.status     = status
+        self.session    = session
+        self.force      = force
+        self.adapters   = {}
+        # A shared balancer keeps its measurements across batches
+        self.balancer   = balancer or Balancer(adapters)
+        self.sent       = {}
+        self.results    = {}
+        self.elapsed    = 0
+
+    ''' Connection slots of an adapter, None is the default one '''
+    def Slots(self, adapter=None):
+        if (adapter not in self.adapters):
+            self.adapters[adapter] = asyncio.Semaphore(self.limit)
+        return self.adapters[adapter]
+
+    ''' Upload to every device, returns the batch report '''
+    async def Run(self):
+        start = time.monotonic()
+        await asyncio.gather(*[self.Device(*dev) for dev in self.devices])
+        self.elapsed = time.monotonic() - start
+
+        return self.Report()
+
+    ''' Upload to one device, with retries '''
+    async def Device(self, address, name="", pinned=None):
+        error = ""
+        for attempt in range(self.retries + 1):
+            if (attempt > 0):
+                delay = self.backoff * 2 ** (attempt - 1)
+                self.Status(address, "Retrying in %.1fs" % delay)
+                await asyncio.sleep(delay)
+
+            adapter = pinned or self.balancer.Pick()
+            self.balancer.Start(adapter)
+            rate = 0
+            try:
+                async with self.Slots(adapter):
+                    self.sent[address] = 0
+                    upload = Upload(address, self.payload, self.background, name,
+                        self.probe, lambda sent, total: self.OnProgress(address, sent),
+                        lambda text: self.Status(address, text), force=self.force,
+                        adapter=adapter)
+                    try:
+                        if (self.session):
+                            summary = await self.session.Upload(upload)
+                        else:
+                            summary = await upload.Run()
+                    except UploadError as e:
+                        error = str(e)
+                    except Exception as e:
+                        error = "Upload failed: " + str(e)
+                    else:
+                        rate = summary["rate"]
+                        summary["attempts"] = attempt + 1
+                        summary["adapter"] = adapter
+                        self.results[address] = summary
+                        self.Status(address, "Transfer complete.")
+                        return
+            finally:
+                self.balancer.Done(adapter, rate)
+
+            self.Status(address, "[ERROR] " + error)
+
+        self.results[address] = {"error": error, "attempts": self.retries + 1}
+
+    ''' Device progress, reported as the batch progress '''
+    def OnProgress(self, address, sent):
+        self.sent[address] = sent
+        if (self.progress):
+            self.progress(sum(self.sent.values()), self.payload.size * len(self.devices))
+
+    ''' Device status message '''
+    def Status(self, address, text):
+        if (self.status): self.status(address + ": " + text)
+
+    ''' Batch report '''
+    def Report(self):
+        done = [r for r in self.results.values() if "error" not in r]
+        sent = sum(r["bytes"] for r in done)
+        return {
+            "devices": len(self.devices),
+            "done": len(done),
+            "failed": len(self.devices) - len(done),
+            "bytes": sent,
+            "seconds": round(self.elapsed, 3),
+            "rate": int(sent / self.elapsed) if self.elapsed > 0 else 0,
+            "results": self.results,
+        }
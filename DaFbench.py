@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+
+'''
+    DaFup transfer benchmark, uploads against the simulated watch.
+
+    Author: Vic <vicpt[at]protonmail.com>
+    Copyright (C) 2024 Vic
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import statistics
+import subprocess
+from DaFcore import Payload, Upload, Verify, NTYCHAR, FormatRate
+from DaFsim import SimClient, MTU, LATENCY, NOTIFY, LOSS, BUFFER
+
+
+''' Representative payloads, name: (size, background) '''
+PAYLOADS = {
+    "background": (240 * 240 * 2, True), # 240x240 RGB565
+    "face": (200 * 1024, False),
+}
+
+''' Link scenarios, name: simulated watch settings '''
+SCENARIOS = {
+    "default": {},
+    "lossy": {"loss": 0.02},
+    "slow": {"latency": 0.01},
+    "small-mtu": {"mtu": 23},
+    "silent": {"silent": True},
+    "marker": {"marker": True},
+}
+
+
+''' Modules timed by the startup benchmark '''
+MODULES = ("DaFproto", "DaFcore", "DaFsession", "DaFscan", "DaFbatch", "DaFdaemon")
+
+''' Where the entry points live '''
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+''' Percentile of a list of values '''
+def Percentile(values, p):
+    if (not values): return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+''' Upload one payload to a simulated watch, returns the run report '''
+async def Run(size, background, probe=False, seed=0, **settings):
+    data = random.Random(seed).randbytes(size)
+    client = SimClient(seed=seed, **settings)
+    upload = Upload(client.address, Payload(data), background, probe=probe)
+
+    start = time.monotonic()
+    await client.connect()
+    try:
+        await Verify(client)
+        await client.start_notify(NTYCHAR, upload.callback)
+        summary = await upload.Run(client)
+    finally:
+        await client.disconnect()
+    wall = time.monotonic() - start
+
+    return {
+        "bytes": summary["bytes"],
+        "chunk": summary["chunk"],
+        "chunks": summary["chunks"],
+        "rate": summary["rate"],
+        "p50": round(Percentile(client.latencies, 50) * 1000, 2),
+        "p99": round(Percentile(client.latencies, 99) * 1000, 2),
+        "wall": round(wall, 3),
+        "paced": summary["paced"],
+        "retries": summary["retries"],
+        "resent": summary["resent"],
+        "verified": summary["verified"],
+        "stored": client.done,
+    }
+
+
+''' Run every payload in every scenario '''
+async def Bench(payloads, scenarios, probe=False, seed=0, **settings):
+    results = []
+    for scenario in scenarios:
+        for name in payloads:
+            size, background = PAYLOADS[name]
+            result = await Run(size, background, probe, seed,
+                **dict(settings, **SCENARIOS[scenario]))
+            results.append(dict(scenario=scenario, payload=name, **result))
+    return results
+
+
+''' Import time of a module in a fresh interpreter, and whether it loaded bleak '''
+def ImportTime(module):
+    code = ("import sys, time; t = time.perf_counter(); import " + module +
+        "; print(time.perf_counter() - t, 'bleak' in sys.modules)")
+    out = subprocess.run([sys.executable, "-c", code], cwd=HERE, check=True,
+        capture_output=True, text=True).stdout.split()
+    return float(out[0]), out[1] == "True"
+
+
+''' Wall time of a command until it exits, or until it prints marker '''
+def WallTime(args, marker=None, env=None, timeout=30):
+    start = time.time()
+    proc = subprocess.Popen(args, cwd=HERE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+        text=True, env=dict(os.environ, **(env or {}), DAFUP_STARTUP=str(start)))
+    try:
+        if (marker is None):
+            proc.wait(timeout)
+            return time.time() - start if proc.returncode == 0 else None
+        for line in proc.stdout:
+            if (line.startswith(marker)): return float(line.split()[-1])
+        return None
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+''' Startup benchmark: module import times, CLI start and GUI time to first frame '''
+def Startup(runs=5):
+    results = []
+    for module in MODULES:
+        times = [ImportTime(module) for i in range(runs)]
+        results.append({"startup": "import " + module,
+            "seconds": round(statistics.median(t[0] for t in times), 4),
+            "bleak": times[0][1]})
+
+    cli = [WallTime([sys.executable, "DaFup-cli.py", "--help"]) for i in range(runs)]
+    results.append({"startup": "DaFup-cli.py --help",
+        "seconds": round(statistics.median(cli), 4) if None not in cli else None})
+
+    # Needs GTK and a display
+    gui = [WallTime([sys.executable, "DaFup.py"], "first frame") for i in range(runs)]
+    results.append({"startup": "DaFup.py first frame",
+        "seconds": round(statistics.median(gui), 4) if None not in gui else None})
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="DaFup transfer benchmark against a simulated watch.")
+    parser.add_argument("--payload", action="append", choices=sorted(PAYLOADS),
+        help="payload to upload, may repeat (default: all)")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+        help="link scenario, may repeat (default: all)")
+    parser.add_argument("--mtu", type=int, default=MTU,
+        help="negotiated ATT MTU")
+    parser.add_argument("--latency", type=float, default=LATENCY,
+        help="seconds the watch takes to store a chunk")
+    parser.add_argument("--notify", type=float, default=NOTIFY,
+        help="seconds from storing a chunk to its notification")
+    parser.add_argument("--loss", type=float, default=LOSS,
+        help="probability a chunk is lost")
+    parser.add_argument("--buffer", type=int, default=BUFFER,
+        help="chunks the watch buffers before refusing writes")
+    parser.add_argument("--probe", action="store_true",
+        help="probe chunk sizes and keep the fastest")
+    parser.add_argument("--seed", type=int, default=0,
+        help="seed of the payloads and the simulated losses")
+    parser.add_argument("--json", action="store_true",
+        help="print the results as JSON")
+    parser.add_argument("--startup", action="store_true",
+        help="time imports, CLI start and GUI first frame instead of transfers")
+    parser.add_argument("--runs", type=int, default=5,
+        help="startup runs, the median is reported")
+    args = parser.parse_args()
+
+    if (args.startup):
+        results = Startup(max(1, args.runs))
+        if (args.json):
+            print (json.dumps(results, indent=1))
+        else:
+            for r in results:
+                seconds = "%.1f ms" % (r["seconds"] * 1000) if r["seconds"] is not None else "unavailable"
+                print ("%-28s %12s%s" % (r["startup"], seconds, " (loads bleak)" if r.get("bleak") else ""))
+        sys.exit(0)
+
+    results = asyncio.run(Bench(args.payload or list(PAYLOADS),
+        args.scenario or list(SCENARIOS), args.probe, args.seed,
+        mtu=args.mtu, latency=args.latency, notify=args.notify,
+        loss=args.loss, buffer=args.buffer))
+
+    if (args.json):
+        print (json.dumps(results, indent=1))
+    else:
+        print ("%-10s %-10s %8s %6s %11s %9s %9s %8s %s" % ("scenario", "payload",
+            "bytes", "chunk", "rate", "p50 ms", "p99 ms", "wall s", "paced"))
+        for r in results:
+            print ("%-10s %-10s %8d %6d %11s %9.2f %9.2f %8.3f %s" % (r["scenario"],
+                r["payload"], r["bytes"], r["chunk"], FormatRate(r["rate"]),
+                r["p50"], r["p99"], r["wall"], r["paced"]))
+
+    # Every simulated watch must end up with the whole file
+    sys.exit(0 if all(r["stored"] for r in results) else 1)
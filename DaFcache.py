@@ -0,0 +1,198 @@
+'''
+    DaFup on-disk caches.
+
+    Author: Vic <vicpt[at]protonmail.com>
+    Copyright (C) 2024 Vic
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+import os
+import json
+import time
+import threading
+
+
+''' Cache defaults '''
+DEVICETTL     = 30 * 24 * 3600 # Seconds a verified watch stays cached
+CHECKPOINTTTL = 24 * 3600      # Seconds an interrupted upload can resume
+ASSETTTL      = 7 * 24 * 3600  # Seconds an uploaded file is trusted to be kept
+JOBTTL        = 7 * 24 * 3600  # Seconds a daemon job is kept after its last change
+FILETTL       = 30 * 24 * 3600 # Seconds a library file is trusted without a change
+
+
+''' Cache directory, created when missing '''
+def CacheDir():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    path = os.path.join(base, "dafup")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+''' JSON file of records keyed by a string, evicted after ttl seconds '''
+class Store:
+
+    def __init__(self, filen, ttl=0):
+        self.path    = os.path.join(CacheDir(), filen)
+        self.ttl     = ttl
+        self.lock    = threading.Lock()
+        self.records = {}
+        self.Load()
+
+    ''' Read the file, a missing or broken file is an empty store '''
+    def Load(self):
+        try:
+            with open(self.path, "r") as fo:
+                self.records = json.load(fo)
+        except (OSError, ValueError):
+            self.records = {}
+        self.Evict()
+
+    ''' Write the file atomically '''
+    def Save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as fo:
+            json.dump(self.records, fo, indent=1)
+        os.replace(tmp, self.path)
+
+    ''' Drop expired records '''
+    def Evict(self):
+        if (self.ttl <= 0): return
+        now = time.time()
+        for key in [k for k, r in self.records.items() if now - r.get("seen", 0) > self.ttl]:
+            del self.records[key]
+
+    ''' Record for key, None if missing or expired '''
+    def Get(self, key):
+        with self.lock:
+            self.Evict()
+            return self.records.get(key)
+
+    ''' Create or update the record for key '''
+    def Put(self, key, **fields):
+        with self.lock:
+            record = self.records.setdefault(key, {})
+            record.update(fields)
+            record["seen"] = time.time()
+            self.Save()
+            return record
+
+    ''' Create or update several records, (key, fields) pairs, saved once '''
+    def PutMany(self, items):
+        with self.lock:
+            now = time.time()
+            for key, fields in items:
+                record = self.records.setdefault(key, {})
+                record.update(fields)
+                record["seen"] = now
+            self.Save()
+
+    ''' Update the record for key only if it exists '''
+    def Update(self, key, **fields):
+        with self.lock:
+            if (key not in self.records): return None
+            self.records[key].update(fields)
+            self.records[key]["seen"] = time.time()
+            self.Save()
+            return self.records[key]
+
+    ''' Remove the record for key '''
+    def Remove(self, key):
+        with self.lock:
+            if (self.records.pop(key, None) is not None): self.Save()
+
+    ''' Remove several records, saved once '''
+    def RemoveMany(self, keys):
+        with self.lock:
+            for key in keys:
+                self.records.pop(key, None)
+            self.Save()
+
+
+''' Previously verified watches
+
+    Record per address: name, last rssi, chunk size, service uuids and
+    characteristic handles, so known watches connect without a scan and
+    skip the manufacturer check.
+'''
+class Devices(Store):
+
+    def __init__(self, ttl=DEVICETTL):
+        super().__init__("devices.json", ttl)
+
+    ''' Known watches as [address, name], most recently seen first '''
+    def Known(self):
+        with self.lock:
+            self.Evict()
+            records = sorted(self.records.items(), key=lambda r: -r[1].get("seen", 0))
+            return [[address, record.get("name", "")] for address, record in records]
+
+
+''' Interrupted uploads
+
+    Record per address: payload hash and size, chunk size, background flag
+    and the last offset the watch acknowledged.
+'''
+class Checkpoints(Store):
+
+    def __init__(self, ttl=CHECKPOINTTTL):
+        super().__init__("checkpoints.json", ttl)
+
+
+''' Files on the watches
+
+    Record per address: sha256 of the last face and background uploaded
+    and the face slot last set, so uploading them again only sets the
+    face. Starting an upload clears its kind until the watch has it; a
+    checksum mismatch keeps it cleared.
+'''
+class Assets(Store):
+
+    def __init__(self, ttl=ASSETTTL):
+        super().__init__("assets.json", ttl)
+
+
+''' Daemon job queue
+
+    Record per job id: address, type, file, optional adapter and force,
+    state (queued, running, done, failed or cancelled), creation time and
+    the upload result once finished.
+'''
+class Jobs(Store):
+
+    def __init__(self, ttl=JOBTTL):
+        super().__init__("jobs.json", ttl)
+
+    ''' Every job with its id, oldest first '''
+    def All(self):
+        with self.lock:
+            self.Evict()
+            jobs = [dict(record, id=key) for key, record in self.records.items()]
+        return sorted(jobs, key=lambda job: job.get("created", 0))
+
+
+''' Asset library files
+
+    Record per absolute path: size and mtime when indexed, sha256, type
+    (face, background or None), panel width and height, and for faces
+    their element and image counts.
+'''
+class Files(Store):
+
+    def __init__(self, ttl=FILETTL):
+        super().__init__("library.json", ttl)
+
+    ''' Indexed paths directly inside a directory '''
+    def Paths(self, directory):
+        with self.lock:
+            return [path for path in self.records if os.path.dirname(path) == directory]
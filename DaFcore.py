@@ -0,0 +1,687 @@
+'''
+    DaFup core, shared by the GUI and CLI front ends.
+
+    Author: Vic <vicpt[at]protonmail.com>
+    Copyright (C) 2024 Vic
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+import os
+import mmap
+import time
+import asyncio
+import itertools
+import zlib
+import hashlib
+from typing import TYPE_CHECKING
+from DaFtelemetry import Phase
+from DaFadapter import AdapterArgs
+from DaFlink import Tune, Restore, Achieved
+from DaFproto import (CMDFACE, CMDBACK, Decode, Request, Complete, Uuid16,
+    cmdSendFace, cmdFaceTransferFinish, cmdSetFaceTransfer, cmdSendBackground,
+    cmdBackTransferFinish, cmdSetBackTransfer, cmdSetFace)
+
+# bleak loads on first connection, only type checkers need it here
+if TYPE_CHECKING:
+    from bleak.backends.characteristic import BleakGATTCharacteristic
+
+
+''' Main characteristic uuids '''
+CTRCHAR = Uuid16(0xfee2) # Write (no response)
+SNDCHAR = Uuid16(0xfee6) # Send data
+NTYCHAR = Uuid16(0xfee3) # Notify
+MANCHAR = Uuid16(0x2a29) # Manufacturer name
+
+MANUFACTURER = "MOYOUNG-V2"
+
+
+''' Transfer pacing defaults '''
+WINDOW   = 4     # Chunks in flight before waiting for a notification
+MINDELAY = 0.005 # Shortest delay between chunks (seconds), once acknowledged
+MAXDELAY = 0.3   # Delay until the watch acknowledges, the old fixed delay
+STALL    = 2.0   # Seconds without notification before the watch is stalled
+RETRIES  = 5     # Write retries for a single chunk
+VERIFY   = 3.0   # Seconds to wait for the watch to confirm the transfer
+SAVE     = 1.0   # Seconds between checkpoints of the acknowledged offset
+START    = 0.5   # Longest wait for the watch to answer the start command
+
+''' Chunk sizing defaults '''
+CHUNK    = 512   # Largest chunk the watch accepts (ATT value limit)
+MINCHUNK = 20    # Payload of the default 23 bytes ATT MTU
+PROBE    = (512, 244, 180)  # Chunk sizes tried by the probing mode
+PROBELEN = 8     # Chunks sent with each probed size
+
+''' Watch face slots showing an uploaded file '''
+SLOTFACE = 6 # Custom watch face
+SLOTBACK = 1 # Face drawn over the custom background
+
+''' Chunk size overrides, advertised name prefix: chunk size
+    Watches whose firmware misbehaves with the negotiated size go here,
+    e.g. "C20": 244.
+'''
+MODELS = {}
+
+
+''' Format a bytes/s value '''
+def FormatRate(rate=0):
+    if (rate >= 1024):
+        return "%.1f KB/s" % (rate / 1024)
+    return "%d B/s" % rate
+
+
+''' Chunk size for a connected client and advertised device name '''
+async def ChunkSize(client, name=""):
+    for model in MODELS:
+        if (name.startswith(model)): return MODELS[model]
+
+    # BlueZ only knows the MTU after acquiring it
+    backend = getattr(client, "_backend", None)
+    if (hasattr(backend, "_acquire_mtu")):
+        try:
+            await backend._acquire_mtu()
+        except Exception:
+            pass
+
+    try:
+        mtu = client.mtu_size
+    except Exception:
+        return CHUNK
+
+    # ATT write header takes 3 bytes of the MTU
+    return max(MINCHUNK, min(mtu - 3, CHUNK))
+
+
+''' Payload checksum, compared with the one the watch reports
+    CRC-32 until the firmware algorithm is known, swap it here.
+'''
+def Checksum(payload):
+    return zlib.crc32(payload.view) & 0xffffffff
+
+
+''' Payload source
+
+    Memory maps a file once, or wraps any buffer, and hands out memoryview
+    chunks lazily, so the payload is never copied or read twice.
+'''
+class Payload:
+
+    def __init__(self, source):
+        self.fo = None
+        self.map = None
+        self.hash = None
+        if (isinstance(source, (str, os.PathLike))):
+            self.fo = open(source, "rb")
+            # Empty files can't be mapped
+            if (os.fstat(self.fo.fileno()).st_size > 0):
+                self.map = mmap.mmap(self.fo.fileno(), 0, access=mmap.ACCESS_READ)
+                source = self.map
+            else:
+                source = b""
+        self.view = memoryview(source).cast("B")
+        self.size = self.view.nbytes
+
+    def __len__(self):
+        return self.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.Close()
+
+    ''' Chunks of size bytes, starting at offset '''
+    def Chunks(self, size, offset=0):
+        for start in range(offset, self.size, size):
+            yield self.view[start:start + size]
+
+    ''' SHA-256 of the payload, hex '''
+    def Hash(self):
+        if (self.hash is None):
+            self.hash = hashlib.sha256(self.view).hexdigest()
+        return self.hash
+
+    ''' Release the buffer and the file. Chunks still alive, e.g. held by
+        the traceback of a failed upload, keep the map until collected.
+    '''
+    def Close(self):
+        try:
+            self.view.release()
+            if (self.map): self.map.close()
+        except BufferError:
+            pass
+        if (self.fo): self.fo.close()
+
+
+''' Windowed chunk transfer engine
+
+    Writes are paced by the NTYCHAR notifications the watch sends while
+    receiving: every notification returns one credit, and at most `window`
+    chunks are written without one. Watches that never notify during the
+    transfer are paced by a delay instead, starting at the old fixed one:
+    a write without response doesn't tell when the watch buffer is full.
+    It grows when a write fails or the watch stalls and only shrinks while
+    the watch acknowledges. The client only needs an awaitable
+    write_gatt_char(), so a simulated peripheral can stand in for a
+    BleakClient.
+
+    Transfer notifications of `cmd` decode to Request and Complete events:
+    indexes the watch asks for again are resent one by one, Complete ends
+    the transfer, with the watch checksum when it reports one.
+'''
+class Transfer:
+
+    def __init__(self, client, char, window=WINDOW, delay=MAXDELAY,
+                 progress=None, cmd=None, checkpoint=None, telemetry=None):
+        self.client   = client
+        self.telemetry = telemetry
+        self.notified = None
+        self.char     = char
+        self.cmd      = cmd
+        self.window   = max(1, window)
+        self.delay    = delay
+        self.progress = progress
+        self.checkpoint = checkpoint
+        self.saved    = 0
+        self.resumed  = 0
+        self.credits  = self.window
+        self.acked    = False
+        self.event    = asyncio.Event()
+        self.sent     = 0
+        self.chunks   = 0
+        self.retries  = 0
+        self.stalls   = 0
+        self.elapsed  = 0
+        self.size     = CHUNK
+        self.probed   = {}
+        self.offsets  = []
+        self.missing  = []
+        self.resent   = 0
+        self.highest  = -1
+        self.complete = False
+        self.reported = None
+        self.checksum = None
+        self.verified = None
+
+    ''' Handle a decoded notification received during the transfer '''
+    def Notify(self, event):
+        if (self.telemetry):
+            now = time.monotonic()
+            if (self.notified is not None):
+                self.telemetry.Observe("notify_gap_seconds", now - self.notified)
+            self.notified = now
+        if (event is not None and event.cmd == self.cmd):
+            # Only the watch answering chunks gives a credit back
+            if (isinstance(event, (Request, Complete))):
+                self.acked = True
+                self.credits = min(self.credits + 1, self.window)
+            if (isinstance(event, Complete)):
+                self.complete = True
+                self.reported = event.checksum
+            elif (isinstance(event, Request)):
+                # Acknowledged indexes only grow, asking an older one
+                # again means the watch missed it
+                index = event.index
+                if (index <= self.highest and index < self.chunks and
+                    index not in self.missing):
+                    self.missing.append(index)
+                elif (index > self.highest):
+                    self.highest = index
+                    self.Save()
+        self.event.set()
+
+    ''' Offset the watch acknowledged so far '''
+    def Acked(self):
+        if (self.highest < 0): return 0
+        if (self.highest < len(self.offsets)): return self.offsets[self.highest][0]
+        return self.sent
+
+    ''' Report the acknowledged offset, at most every SAVE seconds '''
+    def Save(self):
+        if (self.checkpoint is None or time.monotonic() - self.saved < SAVE): return
+        self.saved = time.monotonic()
+        self.checkpoint(self.Acked())
+
+    ''' Wait until a chunk may be written '''
+    async def Pace(self):
+        if (not self.acked):
+            # No notifications so far, pace by delay
+            await asyncio.sleep(self.delay)
+            return
+
+        while (self.credits <= 0):
+            self.event.clear()
+            try:
+                await asyncio.wait_for(self.event.wait(), STALL)
+            except asyncio.TimeoutError:
+                # Watch stopped answering, back off and go on by delay
+                self.stalls += 1
+                if (self.telemetry): self.telemetry.Count("stalls_total")
+                self.delay = min(self.delay * 2, MAXDELAY)
+                self.acked = False
+                self.credits = self.window
+                await asyncio.sleep(self.delay)
+        self.credits -= 1
+
+    ''' Write the chunk at offset, backing off while the link refuses it '''
+    async def Write(self, data, offset):
+        start = time.monotonic()
+        for attempt in range(RETRIES + 1):
+            try:
+                await self.client.write_gatt_char(self.char, data, response=False)
+                break
+            except Exception:
+                if (attempt == RETRIES): raise
+                self.retries += 1
+                if (self.telemetry): self.telemetry.Count("write_retries_total")
+                self.delay = min(self.delay * 2, MAXDELAY)
+                await asyncio.sleep(self.delay)
+
+        # Recover speed slowly after a back off, on the watch's word only
+        if (self.acked): self.delay = max(self.delay * 0.9, MINDELAY)
+        if (self.telemetry):
+            seconds = time.monotonic() - start
+            self.telemetry.Observe("write_seconds", seconds)
+            self.telemetry.Chunk("write", offset=offset, bytes=len(data),
+                seconds=round(seconds, 6), attempts=attempt + 1)
+
+    ''' Send one chunk when paced '''
+    async def Chunk(self, data, total):
+        await self.Pace()
+        await self.Write(data, self.sent)
+        self.offsets.append((self.sent, len(data)))
+        self.sent += len(data)
+        self.chunks += 1
+        if (self.progress): self.progress(self.sent, total)
+
+    ''' Send the first chunks with each probed size, returns the fastest '''
+    async def Probe(self, payload, sizes):
+        for size in sizes:
+            start = time.monotonic()
+            sent = self.sent
+            for data in itertools.islice(payload.Chunks(size, self.sent), PROBELEN):
+                await self.Chunk(data, payload.size)
+            elapsed = time.monotonic() - start
+            if (elapsed > 0 and self.sent > sent):
+                self.probed[size] = int((self.sent - sent) / elapsed)
+
+        if (not self.probed): return self.size
+        return max(self.probed, key=self.probed.get)
+
+    ''' Send a payload in chunks of size bytes, returns the transfer summary
+
+        A non zero offset resumes a transfer the watch already has up to
+        there, sent with the same chunk size.
+    '''
+    async def Send(self, payload, size=CHUNK, probe=(), offset=0):
+        if (not isinstance(payload, Payload)): payload = Payload(payload)
+        self.size = size
+        if (offset):
+            # Chunks the watch got before, so their indexes still resolve
+            self.offsets = [(o, min(size, payload.size - o)) for o in range(0, offset, size)]
+            self.chunks = len(self.offsets)
+            self.sent = self.resumed = offset
+            probe = ()
+
+        start = time.monotonic()
+        if (probe):
+            # Never probe above what the link negotiated
+            sizes = sorted({size} | {s for s in probe if s < size}, reverse=True)
+            self.size = await self.Probe(payload, sizes)
+        for data in payload.Chunks(self.size, self.sent):
+            await self.Chunk(data, payload.size)
+        self.elapsed = time.monotonic() - start
+
+        return self.Summary()
+
+    ''' Resend the chunks the watch misses until it confirms the transfer
+
+        A watch that never confirms leaves the transfer unverified. The
+        checksum algorithm of the firmware isn't confirmed yet, so a
+        mismatch only marks the transfer unverified: the watch still gets
+        the finish commands.
+    '''
+    async def Verify(self, payload, timeout=VERIFY):
+        start = time.monotonic()
+        # Watches that never notify can't confirm anything
+        while (self.acked and not self.complete):
+            self.event.clear()
+            while (self.missing):
+                offset, length = self.offsets[self.missing.pop(0)]
+                await self.Write(payload.view[offset:offset + length], offset)
+                self.resent += 1
+            if (self.complete): break
+            try:
+                await asyncio.wait_for(self.event.wait(), timeout)
+            except asyncio.TimeoutError:
+                break
+        self.elapsed += time.monotonic() - start
+
+        if (not self.complete): return self.Summary()
+        self.checksum = Checksum(payload)
+        if (self.reported is not None):
+            self.verified = self.reported == self.checksum
+        else:
+            self.verified = True
+
+        return self.Summary()
+
+    ''' Transfer summary '''
+    def Summary(self):
+        sent = self.sent - self.resumed
+        rate = sent / self.elapsed if self.elapsed > 0 else 0
+        return {
+            "bytes": sent,
+            "resumed": self.resumed,
+            "chunks": self.chunks,
+            "chunk": self.size,
+            "probed": self.probed,
+            "seconds": round(self.elapsed, 3),
+            "rate": int(rate),
+            "paced": "notify" if self.acked else "delay",
+            "retries": self.retries,
+            "stalls": self.stalls,
+            "resent": self.resent,
+            "verified": self.verified,
+            "checksum": "%08x" % self.checksum if self.checksum is not None else None,
+        }
+
+
+''' Notification dispatcher
+
+    Decodes the NTYCHAR notifications into events and hands every one to
+    the listeners, in arrival order. A sender expecting an answer registers
+    a future for its command before writing, so the answer can't slip by,
+    and awaits it with a timeout.
+'''
+class Notifications:
+
+    def __init__(self):
+        self.listeners = []
+        self.waiters   = []
+
+    ''' Call fn(event) for every notification, None for non frames '''
+    def Listen(self, fn):
+        self.listeners.append(fn)
+
+    def Unlisten(self, fn):
+        if (fn in self.listeners): self.listeners.remove(fn)
+
+    ''' Future of the next event of cmd accepted by match(event) '''
+    def Expect(self, cmd, match=None):
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.append((cmd, match, future))
+        return future
+
+    ''' Await an expected event, None once timeout seconds passed '''
+    async def Wait(self, future, timeout):
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self.waiters = [w for w in self.waiters if w[2] is not future]
+
+    ''' Dispatch a notification '''
+    def Feed(self, data):
+        event = Decode(data)
+        for fn in list(self.listeners):
+            fn(event)
+        if (event is None): return
+
+        for waiter in list(self.waiters):
+            cmd, match, future = waiter
+            if (cmd != event.cmd or future.done()): continue
+            if (match is None or match(event)):
+                future.set_result(event)
+                self.waiters.remove(waiter)
+
+
+''' Upload failure, the message is meant for the user '''
+class UploadError(Exception):
+    pass
+
+
+''' Check the connected device is a moyoung watch '''
+async def Verify(client):
+    # Check if device has a moyoung manufacturer characteristic
+    try:
+        manfact = await client.read_gatt_char(MANCHAR)
+    except Exception:
+        raise UploadError("It doesn't look a MOYOUNG-V2 compatible device.")
+
+    # Check if device manufacturer characteristic reads as a moyoung
+    if (manfact.decode("utf-8") != MANUFACTURER):
+        raise UploadError("It doesn't look a MOYOUNG-V2 compatible device.")
+
+
+''' Characteristic handles and service uuids of a connected watch '''
+def Resolve(client):
+    handles = {}
+    services = set()
+    for key, uuid in (("ctr", CTRCHAR), ("snd", SNDCHAR), ("nty", NTYCHAR), ("man", MANCHAR)):
+        char = client.services.get_characteristic(uuid)
+        if (char is None): continue
+        handles[key] = char.handle
+        services.add(char.service_uuid)
+
+    return handles, sorted(services)
+
+
+''' Upload session, sends one payload to one watch
+
+    Holds no front end state, so several sessions can run concurrently on
+    the same event loop and share one Payload. Unless `tune` is False the
+    link asks for a fast connection while the chunks stream.
+'''
+class Upload:
+
+    def __init__(self, address, payload, background=False, name="",
+                 probe=False, progress=None, status=None, handles=None, chunk=0,
+                 checkpoints=None, assets=None, force=False, telemetry=None,
+                 adapter=None, tune=None):
+        self.address    = address
+        self.payload    = payload
+        self.background = background
+        self.name       = name
+        self.probe      = probe
+        self.progress   = progress
+        self.status     = status
+        self.handles    = handles or {}
+        self.chunk      = chunk
+        self.checkpoints = checkpoints
+        self.assets     = assets
+        self.force      = force
+        self.telemetry  = telemetry
+        self.adapter    = adapter
+        self.tune       = tune
+        self.notifications = Notifications()
+        self.transfer   = None
+
+    ''' Connect, send and disconnect, returns the transfer summary
+
+        A client given by the caller is used as is: it must be verified and
+        forward NTYCHAR notifications to self.callback().
+    '''
+    async def Run(self, client=None):
+        if (client): return await self.Send(client)
+
+        # Main connection
+        from bleak import BleakClient
+        client = BleakClient(self.address, **AdapterArgs(self.adapter))
+        try:
+            with Phase(self.telemetry, "connect", address=self.address):
+                await client.connect()
+        except Exception:
+            raise UploadError("Can't connect to device.")
+
+        try:
+            with Phase(self.telemetry, "manufacturer", address=self.address):
+                await Verify(client)
+            # Start notify system, self.callback() handle it
+            with Phase(self.telemetry, "start_notify", address=self.address):
+                await client.start_notify(NTYCHAR, self.callback)
+            return await self.Send(client)
+        finally:
+            if (client.is_connected):
+                with Phase(self.telemetry, "disconnect", address=self.address):
+                    await client.disconnect()
+
+    ''' Send the payload over a verified client '''
+    async def Send(self, client):
+        # Resolved handles skip the characteristic lookup by uuid
+        ctrchar = self.handles.get("ctr", CTRCHAR)
+        sndchar = self.handles.get("snd", SNDCHAR)
+
+        # The watch has this very file already, just show it
+        if (self.Stored()):
+            if (self.status): self.status("Already on the watch, applying...")
+            with Phase(self.telemetry, "apply", address=self.address):
+                await self.Apply(client, ctrchar)
+            summary = Transfer(client, sndchar).Summary()
+            summary.update(bytes=0, chunk=self.chunk, skipped=True, link=None)
+            return summary
+
+        # Largest chunk the connection takes, unless known already
+        chunk = self.chunk or await ChunkSize(client, self.name)
+
+        # Resuming needs the chunk size of the interrupted upload
+        point = self.Checkpoint()
+        if (point and point["chunk"] <= chunk):
+            chunk = point["chunk"]
+        else:
+            point = None
+
+        # Background or watch face
+        if (self.background):
+            cmd = cmdSendBackground(self.payload.size)
+        else:
+            cmd = cmdSendFace(self.payload.size)
+        # The transfer sees the notifications answering the start command
+        notify = CMDBACK if self.background else CMDFACE
+        self.transfer = Transfer(client, sndchar, progress=self.progress,
+            cmd=notify, checkpoint=self.OnCheckpoint, telemetry=self.telemetry)
+        self.notifications.Listen(self.transfer.Notify)
+        try:
+            return await self.Stream(client, ctrchar, cmd, notify, chunk, point)
+        finally:
+            self.notifications.Unlisten(self.transfer.Notify)
+            self.transfer = None
+
+    ''' Start the transfer, stream, verify and finish it '''
+    async def Stream(self, client, ctrchar, cmd, notify, chunk, point):
+        # The slot is overwritten from now on
+        if (self.assets): self.assets.Update(self.address, **{self.Kind(): None})
+        # Send start transfer command, the watch answers with the first
+        # chunk it wants; silent watches get START seconds to get ready
+        answer = self.notifications.Expect(notify, lambda e: isinstance(e, Request))
+        with Phase(self.telemetry, "start", address=self.address, size=self.payload.size):
+            await client.write_gatt_char(ctrchar, cmd, response=False)
+            await self.notifications.Wait(answer, START)
+
+        # A watch asking for a later chunk kept the interrupted upload
+        offset = 0
+        if (point and 0 < self.transfer.highest * chunk < self.payload.size):
+            offset = self.transfer.highest * chunk
+
+        if (self.status):
+            if (offset):
+                self.status("Resuming at " + str(offset * 100 // self.payload.size) + "%...")
+            else:
+                self.status("Transferring...")
+        # Short connection interval and 2M PHY while the chunks flow
+        link = None
+        if (self.tune is not False):
+            with Phase(self.telemetry, "tune", address=self.address):
+                link = await Tune(client, self.adapter)
+            if (self.telemetry): self.telemetry.Event("link", address=self.address, **Achieved(link))
+        try:
+            # Stream the chunks, paced by the watch notifications
+            with Phase(self.telemetry, "stream", address=self.address, chunk=chunk, offset=offset):
+                await self.transfer.Send(self.payload, chunk,
+                    PROBE if self.probe else (), offset)
+
+            # Resend what the watch missed and check it got the right file
+            if (self.status): self.status("Verifying...")
+            with Phase(self.telemetry, "verify", address=self.address):
+                summary = await self.transfer.Verify(self.payload)
+        finally:
+            if (link and link["method"] and client.is_connected):
+                with Phase(self.telemetry, "restore", address=self.address):
+                    await Restore(client, link)
+        summary["link"] = Achieved(link) if link else None
+        if (self.checkpoints): self.checkpoints.Remove(self.address)
+
+        # Send finish command
+        # Background or watch face
+        with Phase(self.telemetry, "finish", address=self.address):
+            if (self.background):
+                cmd = cmdBackTransferFinish()
+                await client.write_gatt_char(ctrchar, cmd, response=False)
+                cmd = cmdSetBackTransfer()
+                await client.write_gatt_char(ctrchar, cmd, response=False)
+            else:
+                cmd = cmdFaceTransferFinish()
+                await client.write_gatt_char(ctrchar, cmd, response=False)
+                cmd = cmdSetFaceTransfer()
+                await client.write_gatt_char(ctrchar, cmd, response=False)
+            await self.Apply(client, ctrchar)
+        if (self.telemetry): self.telemetry.Event("summary", address=self.address, **summary)
+
+        # Remember what the watch holds now, a mismatching file keeps the
+        # slot cleared so the next upload sends it again
+        if (self.assets and summary["verified"] is not False):
+            self.assets.Put(self.address, **{self.Kind(): self.payload.Hash(),
+                "slot": self.Slot()})
+
+        summary["skipped"] = False
+        return summary
+
+    ''' Asset kind of the payload '''
+    def Kind(self):
+        return "background" if self.background else "face"
+
+    ''' Watch face slot showing the payload '''
+    def Slot(self):
+        return SLOTBACK if self.background else SLOTFACE
+
+    ''' Show the uploaded file on the watch '''
+    async def Apply(self, client, ctrchar):
+        await client.write_gatt_char(ctrchar, cmdSetFace(self.Slot()), response=False)
+
+    ''' Is this payload the last one uploaded to the watch '''
+    def Stored(self):
+        if (self.force or not self.assets): return False
+        record = self.assets.Get(self.address)
+        return record is not None and record.get(self.Kind()) == self.payload.Hash()
+
+    ''' Checkpoint of an interrupted upload of this payload, if any '''
+    def Checkpoint(self):
+        if (not self.checkpoints): return None
+        point = self.checkpoints.Get(self.address)
+        if (point and point.get("hash") == self.payload.Hash() and
+            point.get("background") == self.background):
+            return point
+        return None
+
+    ''' Persist the offset the watch acknowledged '''
+    def OnCheckpoint(self, offset):
+        # Probed chunk sizes don't map indexes to offsets
+        if (not self.checkpoints or self.transfer.probed or offset == 0): return
+        self.checkpoints.Put(self.address, hash=self.payload.Hash(),
+            size=self.payload.size, chunk=self.transfer.size,
+            background=self.background, offset=offset)
+
+    ''' Function that handles service characteristic notification '''
+    def callback(self, sender: "BleakGATTCharacteristic", data: bytearray):
+        self.notifications.Feed(data)
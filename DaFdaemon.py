@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+
+'''
+    DaFup daemon, a long running upload service with a local HTTP job API.
+
+    Author: Vic <vicpt[at]protonmail.com>
+    Copyright (C) 2024 Vic
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+import os
+import json
+import time
+import uuid
+import asyncio
+import argparse
+from DaFcore import Payload, UploadError
+from DaFsession import Session
+from DaFcache import Devices, Checkpoints, Assets, Jobs, CacheDir
+from DaFscan import Scanner
+from DaFbatch import Batch, RETRIES
+from DaFformat import Validate
+from DaFimage import IsImage, Convert, ParsePanel, PANEL
+from DaFadapter import Adapters, Balancer
+from DaFtelemetry import Telemetry
+
+
+''' Daemon defaults '''
+WORKERS = 4   # Uploads running at once
+STREAM  = 0.1 # Seconds between progress events of a job stream
+TYPES   = ("face", "background")
+
+''' HTTP status lines '''
+REASONS = {200: "OK", 201: "Created", 400: "Bad Request", 403: "Forbidden",
+           404: "Not Found", 405: "Method Not Allowed", 409: "Conflict",
+           415: "Unsupported Media Type"}
+
+''' Host headers of local clients, any port '''
+LOCALHOSTS = ("localhost", "127.0.0.1", "[::1]")
+
+
+''' Default socket path '''
+def SocketPath():
+    return os.path.join(os.environ.get("XDG_RUNTIME_DIR") or CacheDir(), "dafup.sock")
+
+
+''' Check a submitted job, returns its record '''
+def Job(job):
+    if (not isinstance(job, dict) or
+        not all(isinstance(job.get(k), str) for k in ("address", "type", "file"))):
+        raise ValueError("Every job needs an address, a type and a file")
+    if (job["type"] not in TYPES):
+        raise ValueError("Job type must be face or background")
+    if (not isinstance(job.get("adapter", ""), str)):
+        raise ValueError("Job adapter must be a name like hci0")
+    return {"address": job["address"], "type": job["type"],
+        "file": os.path.abspath(job["file"]), "adapter": job.get("adapter") or None,
+        "force": bool(job.get("force", False))}
+
+
+''' Upload daemon
+
+    Jobs are kept in the Jobs cache and run by `workers` concurrent
+    workers over one Session, so watches stay connected between jobs and
+    known ones never need a scan. Jobs left queued or running by a
+    previous run are queued again at start, interrupted uploads resume
+    from their checkpoints.
+
+    Browsers are refused, whatever page they come from: requests with an
+    Origin header or a Host other than localhost get 403, and jobs must
+    be posted as application/json, which needs a CORS preflight.
+
+    HTTP API, JSON bodies:
+        POST   /jobs             submit a job or a list of jobs
+        GET    /jobs             list jobs
+        GET    /jobs/<id>        job state, progress and result
+        DELETE /jobs/<id>        cancel a queued job
+        GET    /jobs/<id>/events stream of job events, one JSON per line
+        GET    /devices          known watches
+        GET    /metrics          Prometheus metrics, with telemetry
+'''
+class Daemon:
+
+    def __init__(self, session, jobs, devices, workers=WORKERS, retries=RETRIES,
+                 adapters=(), scanadapter=None, panel=PANEL, check=True, telemetry=None):
+        self.session     = session
+        self.jobs        = jobs
+        self.devices     = devices
+        self.workers     = max(1, workers)
+        self.retries     = retries
+        self.scanadapter = scanadapter
+        self.panel       = panel
+        self.check       = check
+        self.telemetry   = telemetry
+        self.balancer    = Balancer(adapters)
+        self.queue       = None
+        self.streams     = {}
+        self.progress    = {}
+
+    ''' Serve the API on a unix socket path, or on a localhost TCP port '''
+    async def Serve(self, path=None, port=0):
+        self.queue = asyncio.Queue()
+        for job in self.jobs.All():
+            if (job.get("state") in ("queued", "running")):
+                self.jobs.Update(job["id"], state="queued")
+                self.queue.put_nowait(job["id"])
+        workers = [asyncio.ensure_future(self.Worker()) for i in range(self.workers)]
+
+        if (path):
+            if (os.path.exists(path)): os.remove(path)
+            server = await asyncio.start_unix_server(self.Handle, path)
+        else:
+            server = await asyncio.start_server(self.Handle, "127.0.0.1", port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+    ''' Run queued jobs one after the other '''
+    async def Worker(self):
+        while (True):
+            id = await self.queue.get()
+            job = self.jobs.Get(id)
+            if (job is None or job.get("state") != "queued"): continue
+
+            self.jobs.Update(id, state="running", started=time.time())
+            self.Emit(id, state="running")
+            try:
+                result = await self.Run(id, job)
+            except UploadError as e:
+                result = {"error": str(e)}
+            except Exception as e:
+                result = {"error": "Upload failed: " + str(e)}
+            state = "failed" if "error" in result else "done"
+            self.jobs.Update(id, state=state, result=result, finished=time.time())
+            self.progress.pop(id, None)
+            self.Emit(id, state=state, result=result)
+            self.Close(id)
+
+    ''' Upload one job, returns its result '''
+    async def Run(self, id, job):
+        background = job["type"] == "background"
+        filen = job["file"]
+        # Converting on the loop would stall the other workers' transfers
+        if (background and IsImage(filen)):
+            filen = await asyncio.get_running_loop().run_in_executor(None,
+                Convert, filen, self.panel)
+        try:
+            payload = Payload(filen)
+        except OSError as e:
+            raise UploadError("Error opening the file: " + str(e))
+
+        try:
+            if (self.check): Validate(payload, background)
+            address = job["address"]
+            record = self.devices.Get(address)
+            if (record is None):
+                # Unknown watch, BlueZ has to see it before connecting
+                self.Emit(id, status="Searching...")
+                scanner = Scanner(target=address, unfiltered=True, adapter=self.scanadapter)
+                await scanner.Run()
+                dev = scanner.devices.get(address.upper())
+                if (dev is None): raise UploadError("Device not found.")
+                name = dev[1]
+            else:
+                name = record.get("name", "")
+
+            batch = Batch([(address, name, job.get("adapter"))], payload, background,
+                retries=self.retries, progress=lambda sent, total: self.Progress(id, sent, total),
+                status=lambda text: self.Emit(id, status=text), session=self.session,
+                force=job.get("force", False), balancer=self.balancer)
+            return (await batch.Run())["results"][address]
+        finally:
+            payload.Close()
+
+    ''' Job progress, streamed at most every STREAM seconds '''
+    def Progress(self, id, sent, total):
+        last = self.progress.get(id)
+        self.progress[id] = (sent, total, time.monotonic())
+        if (last is None or sent >= total or time.monotonic() - last[2] >= STREAM):
+            self.Emit(id, sent=sent, total=total)
+        else:
+            # Keep the time of the last streamed event
+            self.progress[id] = (sent, total, last[2])
+
+    ''' Send an event to the job streams '''
+    def Emit(self, id, **event):
+        for queue in self.streams.get(id, ()):
+            queue.put_nowait(dict(event, id=id, t=round(time.time(), 3)))
+
+    ''' End the job streams '''
+    def Close(self, id):
+        for queue in self.streams.pop(id, ()):
+            queue.put_nowait(None)
+
+    ''' Job record with its live progress '''
+    def Snapshot(self, id):
+        job = self.jobs.Get(id)
+        if (job is None): return None
+        job = dict(job, id=id)
+        if (id in self.progress):
+            job["sent"], job["total"] = self.progress[id][:2]
+        return job
+
+    ''' Handle one HTTP request '''
+    async def Handle(self, reader, writer):
+        try:
+            line = (await reader.readline()).decode("latin-1")
+            method, target = line.split()[:2]
+            headers = {}
+            while (True):
+                line = (await reader.readline()).decode("latin-1")
+                if (line.strip() == ""): break
+                key, value = line.split(":", 1)
+                headers[key.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+            # Browsers send an Origin, or a foreign Host when DNS rebound
+            host = headers.get("host", "localhost").lower()
+            if (host not in LOCALHOSTS): host = host.rsplit(":", 1)[0]
+            if ("origin" in headers or host not in LOCALHOSTS):
+                return await self.Reply(writer, 403, {"error": "Only local clients are served"})
+            await self.Route(method, target.split("?")[0].rstrip("/"), headers, body, writer)
+        except (ValueError, asyncio.IncompleteReadError):
+            await self.Reply(writer, 400, {"error": "Bad request"})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    ''' Dispatch a request '''
+    async def Route(self, method, path, headers, body, writer):
+        parts = path.strip("/").split("/")
+        if (parts == ["jobs"]):
+            if (method == "GET"): return await self.Reply(writer, 200, self.jobs.All())
+            if (method == "POST"): return await self.Submit(headers, body, writer)
+        elif (len(parts) == 2 and parts[0] == "jobs"):
+            if (method == "GET"): return await self.Get(parts[1], writer)
+            if (method == "DELETE"): return await self.Cancel(parts[1], writer)
+        elif (len(parts) == 3 and parts[0] == "jobs" and parts[2] == "events"):
+            if (method == "GET"): return await self.Stream(parts[1], writer)
+        elif (parts == ["devices"]):
+            if (method == "GET"):
+                return await self.Reply(writer, 200, [dict(self.devices.Get(address) or {},
+                    address=address) for address, name in self.devices.Known()])
+        elif (parts == ["metrics"] and self.telemetry):
+            if (method == "GET"):
+                return await self.Reply(writer, 200, self.telemetry.Prometheus(), "text/plain; version=0.0.4")
+        else:
+            return await self.Reply(writer, 404, {"error": "Not found"})
+        await self.Reply(writer, 405, {"error": "Method not allowed"})
+
+    ''' Queue the posted jobs '''
+    async def Submit(self, headers, body, writer):
+        ctype = headers.get("content-type", "").split(";")[0].strip().lower()
+        if (ctype != "application/json"):
+            return await self.Reply(writer, 415, {"error": "Jobs must be posted as application/json"})
+        try:
+            jobs = json.loads(body or b"null")
+            jobs = [Job(job) for job in (jobs if isinstance(jobs, list) else [jobs])]
+        except ValueError as e:
+            return await self.Reply(writer, 400, {"error": str(e)})
+
+        ids = []
+        for job in jobs:
+            id = uuid.uuid4().hex[:12]
+            self.jobs.Put(id, state="queued", created=time.time(), **job)
+            self.queue.put_nowait(id)
+            ids.append(id)
+        await self.Reply(writer, 201, [self.Snapshot(id) for id in ids])
+
+    async def Get(self, id, writer):
+        job = self.Snapshot(id)
+        if (job is None): return await self.Reply(writer, 404, {"error": "No such job"})
+        await self.Reply(writer, 200, job)
+
+    async def Cancel(self, id, writer):
+        job = self.jobs.Get(id)
+        if (job is None): return await self.Reply(writer, 404, {"error": "No such job"})
+        if (job.get("state") != "queued"):
+            return await self.Reply(writer, 409, {"error": "Only queued jobs can be cancelled"})
+        self.jobs.Update(id, state="cancelled", finished=time.time())
+        self.Emit(id, state="cancelled")
+        self.Close(id)
+        await self.Reply(writer, 200, self.Snapshot(id))
+
+    ''' Stream the job events until it ends '''
+    async def Stream(self, id, writer):
+        job = self.Snapshot(id)
+        if (job is None): return await self.Reply(writer, 404, {"error": "No such job"})
+
+        # Listen before the first await, so the end of the job can't slip by
+        live = job.get("state") in ("queued", "running")
+        queue = asyncio.Queue()
+        if (live): self.streams.setdefault(id, []).append(queue)
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n"
+            b"Connection: close\r\n\r\n")
+        writer.write(json.dumps(job).encode("utf-8") + b"\n")
+        try:
+            await writer.drain()
+            if (not live): return
+            while (True):
+                event = await queue.get()
+                if (event is None): break
+                writer.write(json.dumps(event).encode("utf-8") + b"\n")
+                await writer.drain()
+        finally:
+            if (queue in self.streams.get(id, ())): self.streams[id].remove(queue)
+
+    ''' Send a whole response '''
+    async def Reply(self, writer, status, body, ctype="application/json"):
+        data = (body if isinstance(body, str) else json.dumps(body)).encode("utf-8")
+        writer.write(("HTTP/1.1 %d %s\r\nContent-Type: %s\r\nContent-Length: %d\r\n"
+            "Connection: close\r\n\r\n" % (status, REASONS[status], ctype, len(data))).encode("latin-1"))
+        writer.write(data)
+        await writer.drain()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="DaFup upload daemon with a local HTTP job API.")
+    parser.add_argument("--socket", default=None,
+        help="unix socket to serve on (default: $XDG_RUNTIME_DIR/dafup.sock)")
+    parser.add_argument("--port", type=int, default=0,
+        help="serve on this localhost TCP port instead of a unix socket")
+    parser.add_argument("--workers", type=int, default=WORKERS,
+        help="uploads running at once")
+    parser.add_argument("--retries", type=int, default=RETRIES,
+        help="retries per job")
+    parser.add_argument("--adapter", action="append",
+        help="bluetooth adapter to upload through, may repeat, 'all' for every one")
+    parser.add_argument("--scan-adapter",
+        help="bluetooth adapter to scan with")
+    parser.add_argument("--panel", default="%dx%d" % PANEL,
+        help="watch screen size PNG and JPEG backgrounds are converted to")
+    parser.add_argument("--no-check", action="store_true",
+        help="upload files that don't look like faces or backgrounds")
+    parser.add_argument("--no-tune", action="store_true",
+        help="keep the connection parameters the link started with")
+    parser.add_argument("--log",
+        help="append transfer events to this JSON-lines file")
+    parser.add_argument("--metrics", action="store_true",
+        help="serve Prometheus metrics on /metrics")
+    args = parser.parse_args()
+    try:
+        panel = ParsePanel(args.panel)
+    except ValueError as e:
+        parser.error(str(e))
+
+    adapters = args.adapter or []
+    if ("all" in adapters): adapters = Adapters()
+    telemetry = Telemetry(args.log) if (args.log or args.metrics) else None
+    devices = Devices()
+    session = Session(devices=devices, checkpoints=Checkpoints(), assets=Assets(),
+        telemetry=telemetry, tune=not args.no_tune)
+    daemon = Daemon(session, Jobs(), devices, args.workers, args.retries, adapters,
+        args.scan_adapter, panel, not args.no_check, telemetry)
+
+    path = None if args.port else (args.socket or SocketPath())
+    print ("Serving on " + (path or "http://127.0.0.1:" + str(args.port)))
+    try:
+        session.Run(daemon.Serve(path, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        session.Close()
+        if (telemetry): telemetry.Close()
+        if (path and os.path.exists(path)): os.remove(path)
@@ -0,0 +1,123 @@
+'''
+    DaFup event channel, hands transfer and scan events to a UI thread.
+
+    Author: Vic <vicpt[at]protonmail.com>
+    Copyright (C) 2024 Vic
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+import time
+import threading
+from DaFcore import FormatRate
+
+
+''' Channel defaults '''
+FPS    = 15  # Most UI updates per second
+SMOOTH = 0.3 # Weight of the newest sample in the rate average
+
+
+''' Format a seconds value as m:ss '''
+def FormatTime(seconds=0):
+    seconds = int(seconds)
+    return "%d:%02d" % (seconds // 60, seconds % 60)
+
+
+''' Event channel
+
+    Any thread posts events, the UI thread gets them in batches at most
+    `fps` times a second. Progress only keeps its latest value, statuses,
+    found devices and calls are delivered in order. Posting never waits on
+    the UI: `idle(fn)` and `timeout(ms, fn)` schedule fn on the UI thread,
+    e.g. GLib.idle_add and GLib.timeout_add.
+'''
+class Channel:
+
+    def __init__(self, idle, timeout, progress=None, status=None, found=None,
+                 fps=FPS):
+        self.idle     = idle
+        self.timeout  = timeout
+        self.progress = progress
+        self.status   = status
+        self.found    = found
+        self.interval = 1 / max(1, fps)
+        self.lock     = threading.Lock()
+        self.events   = []
+        self.latest   = None
+        self.pending  = False
+        self.flushed  = 0
+        self.Reset()
+
+    ''' Start a new transfer, forgets the rate of the previous one '''
+    def Reset(self):
+        self.sample = None
+        self.rate   = 0
+
+    ''' Transfer progress, from any thread '''
+    def Progress(self, sent, total):
+        with self.lock:
+            self.latest = (sent, total, time.monotonic())
+            self.Schedule()
+
+    ''' Status message, from any thread '''
+    def Status(self, text):
+        self.Call(self.status, text)
+
+    ''' Device found while scanning, from any thread '''
+    def Found(self, dev):
+        self.Call(self.found, dev)
+
+    ''' Run fn(*args) on the UI thread, from any thread '''
+    def Call(self, fn, *args):
+        if (fn is None): return
+        with self.lock:
+            self.events.append((fn, args))
+            self.Schedule()
+
+    ''' Schedule a flush unless one is pending, lock held '''
+    def Schedule(self):
+        if (self.pending): return
+        self.pending = True
+        wait = self.flushed + self.interval - time.monotonic()
+        if (wait > 0):
+            self.timeout(int(wait * 1000) + 1, self.Flush)
+        else:
+            self.idle(self.Flush)
+
+    ''' Deliver the pending events, on the UI thread '''
+    def Flush(self):
+        with self.lock:
+            events, self.events = self.events, []
+            latest, self.latest = self.latest, None
+            self.pending = False
+            self.flushed = time.monotonic()
+
+        for fn, args in events:
+            fn(*args)
+        if (latest and self.progress):
+            self.progress(latest[1] and latest[0] / latest[1], self.Text(*latest))
+
+        # One shot for GLib sources
+        return False
+
+    ''' Progress text with the smoothed rate and the time left '''
+    def Text(self, sent, total, now):
+        if (self.sample and now > self.sample[1] and sent >= self.sample[0]):
+            rate = (sent - self.sample[0]) / (now - self.sample[1])
+            self.rate = rate if not self.rate else SMOOTH * rate + (1 - SMOOTH) * self.rate
+        self.sample = (sent, now)
+
+        text = str(sent * 100 // total if total else 0) + "%"
+        if (self.rate > 0 and sent < total):
+            text += ", " + FormatRate(self.rate) + ", " + FormatTime((total - sent) / self.rate) + " left"
+        return text
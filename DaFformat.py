@@ -0,0 +1,108 @@
+'''
+    DaFup offline checks of face and background files, and transfer plans.
+
+    Author: Vic <vicpt[at]protonmail.com>
+    Copyright (C) 2024 Vic
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+import math
+import struct
+from DaFcore import CHUNK, FormatRate, UploadError
+
+
+''' Panel resolutions of MoYoung v2 watches, width x height '''
+RESOLUTIONS = ((240, 240), (240, 280), (240, 296), (360, 360))
+
+''' Backgrounds are raw RGB565 pixels, no header '''
+PIXEL = 2
+
+''' Face file layout (little endian): fileID, dataCount, blobCount,
+    faceNumber, 39 elements of type, idx, x, y, w, h, then 250 blob
+    offsets (u32, after the header) and 250 blob sizes (u16).
+'''
+FACEIDS  = (0x81, 0x04, 0x84)  # Known file ids
+ELEMENTS = 39
+BLOBS    = 250
+FACEHEAD = struct.Struct("<BBBH")
+ELEMENT  = struct.Struct("<BBHHHH")
+OFFSETS  = struct.Struct("<%dI" % BLOBS)
+HEADLEN  = FACEHEAD.size + ELEMENTS * ELEMENT.size + OFFSETS.size + BLOBS * 2
+
+''' Planning defaults '''
+RATE = 4096 # Bytes/s assumed for a watch never measured
+
+
+''' Check a face or background file, raises UploadError when it can't be one '''
+def Validate(payload, background=False):
+    if (payload.size == 0): raise UploadError("The file is empty.")
+    if (background):
+        ValidateBackground(payload)
+    else:
+        ValidateFace(payload)
+
+
+''' A background is a whole panel of pixels '''
+def ValidateBackground(payload):
+    sizes = [w * h * PIXEL for w, h in RESOLUTIONS]
+    if (payload.size not in sizes):
+        raise UploadError("Background size " + str(payload.size) + " bytes doesn't fit any " +
+            "watch (" + ", ".join("%dx%d" % r for r in RESOLUTIONS) + " RGB565).")
+
+
+''' A face is a header describing its elements and image blobs '''
+def ValidateFace(payload):
+    if (payload.size < HEADLEN):
+        raise UploadError("Face file too short for a face header.")
+
+    view = payload.view
+    fileid, elements, blobs, number = FACEHEAD.unpack_from(view)
+    if (fileid not in FACEIDS):
+        raise UploadError("Unknown face file id 0x%02x, not a MoYoung face." % fileid)
+    if (not 0 < elements <= ELEMENTS or not 0 < blobs <= BLOBS):
+        raise UploadError("Face header declares %d elements and %d images." % (elements, blobs))
+
+    # Elements must fit on the largest panel
+    width = max(w for w, h in RESOLUTIONS)
+    height = max(h for w, h in RESOLUTIONS)
+    for i in range(elements):
+        kind, idx, x, y, w, h = ELEMENT.unpack_from(view, FACEHEAD.size + i * ELEMENT.size)
+        if (x + w > width or y + h > height):
+            raise UploadError("Face element %d (%dx%d at %d,%d) is off the screen." % (i, w, h, x, y))
+
+    # Image blobs must start inside the file
+    offsets = OFFSETS.unpack_from(view, FACEHEAD.size + ELEMENTS * ELEMENT.size)
+    for i in range(blobs):
+        if (HEADLEN + offsets[i] >= payload.size):
+            raise UploadError("Face image %d lies past the end of the file." % i)
+
+
+''' Transfer plan of a payload at a chunk size and link rate '''
+def Plan(payload, chunk=CHUNK, rate=RATE):
+    chunk = chunk or CHUNK
+    rate = rate or RATE
+    return {
+        "bytes": payload.size,
+        "chunks": math.ceil(payload.size / chunk),
+        "chunk": chunk,
+        "rate": int(rate),
+        "seconds": round(payload.size / rate, 1),
+    }
+
+
+''' One line description of a transfer plan '''
+def FormatPlan(plan):
+    return (str(plan["bytes"]) + " bytes in " + str(plan["chunks"]) + " chunks of " +
+        str(plan["chunk"]) + ", about " + str(plan["seconds"]) + "s at " +
+        FormatRate(plan["rate"]) + ".")
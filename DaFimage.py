@@ -0,0 +1,96 @@
+'''
+    DaFup background conversion of PNG and JPEG images.
+
+    Author: Vic <vicpt[at]protonmail.com>
+    Copyright (C) 2024 Vic
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+import os
+import hashlib
+from DaFcore import UploadError
+from DaFcache import CacheDir
+from DaFformat import RESOLUTIONS
+
+
+''' Conversion defaults '''
+PANEL     = RESOLUTIONS[0] # Panel size when none is given
+BIGENDIAN = True           # RGB565 byte order of the watch
+VERSION   = 1              # Bump when the conversion output changes
+
+''' Image file signatures '''
+SIGNATURES = (b"\x89PNG\r\n\x1a\n", b"\xff\xd8\xff")
+
+
+''' Is the file a PNG or JPEG image '''
+def IsImage(filen):
+    try:
+        with open(filen, "rb") as fo:
+            head = fo.read(8)
+    except OSError:
+        return False
+    return any(head.startswith(sig) for sig in SIGNATURES)
+
+
+''' Parse a WxH panel size '''
+def ParsePanel(text):
+    try:
+        width, height = (int(v) for v in text.lower().split("x"))
+    except ValueError:
+        raise ValueError("Panel size must look like 240x240")
+    return width, height
+
+
+''' Convert an image to a background, returns the path of the converted file
+
+    The image is cropped to the panel aspect, resized and stored as RGB565
+    pixels. Converted files are cached by source hash and panel size, so
+    the same image is converted once.
+'''
+def Convert(filen, panel=PANEL):
+    with open(filen, "rb") as fo:
+        digest = hashlib.sha256(fo.read()).hexdigest()
+    path = os.path.join(CacheDir(), "backgrounds",
+        "%s-%dx%d-%d.bin" % (digest, panel[0], panel[1], VERSION))
+    if (os.path.exists(path)): return path
+
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        raise UploadError("Converting images needs Pillow (python-pillow).")
+    try:
+        with Image.open(filen) as image:
+            image = ImageOps.exif_transpose(image).convert("RGB")
+            image = ImageOps.fit(image, panel, Image.LANCZOS)
+    except Exception as e:
+        raise UploadError("Can't convert the image: " + str(e))
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as fo:
+        fo.write(RGB565(image))
+    os.replace(tmp, path)
+
+    return path
+
+
+''' Pixels of an RGB image as RGB565 '''
+def RGB565(image):
+    from PIL import Image, ImageChops
+    # The bit fields never overlap, so adding them is an or
+    r, g, b = image.split()
+    high = ImageChops.add(r.point(lambda v: v & 0xf8), g.point(lambda v: v >> 5))
+    low = ImageChops.add(g.point(lambda v: (v & 0x1c) << 3), b.point(lambda v: v >> 3))
+    if (BIGENDIAN): return Image.merge("LA", (high, low)).tobytes()
+    return Image.merge("LA", (low, high)).tobytes()
@@ -0,0 +1,241 @@
+'''
+    DaFup asset library: indexed face and background files with thumbnails.
+
+    Author: Vic <vicpt[at]protonmail.com>
+    Copyright (C) 2024 Vic
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+import os
+import threading
+import collections
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from DaFcore import Payload, UploadError
+from DaFcache import Files
+from DaFformat import (RESOLUTIONS, PIXEL, FACEHEAD, ELEMENT, ValidateBackground,
+    ValidateFace)
+from DaFimage import BIGENDIAN
+
+
+''' Library defaults '''
+EXTENSIONS = (".bin",) # Files indexed
+THUMB      = 96        # Thumbnail edge in pixels
+CACHED     = 512       # Thumbnails kept in memory
+
+''' Worker start method, a fork server where the platform has one '''
+START = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+''' Thumbnail colours of face elements, by element type '''
+PALETTE = ((0x4e, 0x79, 0xa7), (0xf2, 0x8e, 0x2b), (0xe1, 0x57, 0x59), (0x76, 0xb7, 0xb2),
+           (0x59, 0xa1, 0x4f), (0xed, 0xc9, 0x48), (0xb0, 0x7a, 0xa1), (0xff, 0x9d, 0xa7))
+
+
+''' Index record of a file: sha256, type (face, background or None when it
+    is neither), panel width and height, and for faces their element and
+    image counts. Runs in the worker processes.
+'''
+def Describe(path):
+    st = os.stat(path)
+    record = {"size": st.st_size, "mtime": st.st_mtime_ns, "type": None}
+    try:
+        with Payload(path) as payload:
+            record["sha256"] = payload.Hash()
+            try:
+                ValidateBackground(payload)
+                record["type"] = "background"
+                record["width"], record["height"] = Panel(payload.size)
+                return record
+            except UploadError:
+                pass
+            ValidateFace(payload)
+            fileid, elements, blobs, number = FACEHEAD.unpack_from(payload.view)
+            boxes = Elements(payload.view, elements)
+    except (OSError, UploadError) as e:
+        record["error"] = str(e)
+        return record
+
+    # Smallest panel holding every element
+    right = max(x + w for kind, x, y, w, h in boxes)
+    bottom = max(y + h for kind, x, y, w, h in boxes)
+    panel = min((r for r in RESOLUTIONS if r[0] >= right and r[1] >= bottom),
+        key=lambda r: r[0] * r[1])
+    record.update(type="face", width=panel[0], height=panel[1], elements=elements,
+        images=blobs, faceid=fileid, number=number)
+    return record
+
+
+''' Panel size of a background of size bytes '''
+def Panel(size):
+    return next((w, h) for w, h in RESOLUTIONS if w * h * PIXEL == size)
+
+
+''' Face elements as (type, x, y, w, h) '''
+def Elements(view, count):
+    boxes = []
+    for i in range(count):
+        kind, idx, x, y, w, h = ELEMENT.unpack_from(view, FACEHEAD.size + i * ELEMENT.size)
+        boxes.append((kind, x, y, w, h))
+    return boxes
+
+
+''' Thumbnail of an indexed file as (width, height, RGB bytes), the longer
+    side edge pixels. Backgrounds are scaled down, faces show the layout
+    of their elements. Runs in the worker processes.
+'''
+def Render(path, record, edge=THUMB):
+    width, height = record["width"], record["height"]
+    scale = edge / max(width, height)
+    tw, th = max(1, round(width * scale)), max(1, round(height * scale))
+    rgb = bytearray(tw * th * 3)
+
+    with Payload(path) as payload:
+        view = payload.view
+        if (record["type"] == "background"):
+            # Nearest pixel, RGB565 to RGB888
+            first, second = (0, 1) if BIGENDIAN else (1, 0)
+            for ty in range(th):
+                row = int(ty / scale) * width
+                for tx in range(tw):
+                    at = (row + int(tx / scale)) * PIXEL
+                    pixel = view[at + first] << 8 | view[at + second]
+                    i = (ty * tw + tx) * 3
+                    rgb[i] = (pixel >> 8 & 0xf8) | pixel >> 13
+                    rgb[i + 1] = (pixel >> 3 & 0xfc) | (pixel >> 9 & 0x03)
+                    rgb[i + 2] = (pixel << 3 & 0xf8) | (pixel >> 2 & 0x07)
+        else:
+            # Later elements are drawn over earlier ones
+            for kind, x, y, w, h in Elements(view, record["elements"]):
+                colour = bytes(PALETTE[kind % len(PALETTE)])
+                left, right = int(x * scale), min(tw, max(int(x * scale) + 1, round((x + w) * scale)))
+                top, bottom = int(y * scale), min(th, max(int(y * scale) + 1, round((y + h) * scale)))
+                for ty in range(top, bottom):
+                    rgb[(ty * tw + left) * 3:(ty * tw + right) * 3] = colour * (right - left)
+
+    return tw, th, bytes(rgb)
+
+
+''' Least recently used cache '''
+class Thumbnails:
+
+    def __init__(self, size=CACHED):
+        self.size  = size
+        self.lock  = threading.Lock()
+        self.items = collections.OrderedDict()
+
+    ''' Cached value of key, None if missing '''
+    def Get(self, key):
+        with self.lock:
+            if (key not in self.items): return None
+            self.items.move_to_end(key)
+            return self.items[key]
+
+    ''' Cache a value, forgets the least recently used ones past the size '''
+    def Put(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while (len(self.items) > self.size):
+                self.items.popitem(last=False)
+
+
+''' Asset library of a directory
+
+    Refresh indexes the face and background files of the directory into a
+    persistent Files index, describing only files new or changed since
+    the last refresh. Describing and rendering thumbnails run in a process
+    pool, thumbnails are cached by file hash, so a file is rendered once
+    however it is named. Nothing here touches the UI: Thumbnail calls back
+    from a pool thread. The workers start from a fork server, or spawn
+    where there's none: forking the threads of the GUI may deadlock them.
+    A Refresh the workers were serving raises once the library closes.
+'''
+class Library:
+
+    def __init__(self, directory, index=None, workers=None, edge=THUMB, cached=CACHED):
+        self.directory = os.path.abspath(directory)
+        self.index   = index if index is not None else Files()
+        self.workers = workers
+        self.edge    = edge
+        self.thumbs  = Thumbnails(cached)
+        self.lock    = threading.Lock()
+        self.pool    = None
+        self.closed  = False
+
+    ''' Worker pool, started on first use '''
+    def Pool(self):
+        with self.lock:
+            if (self.closed): raise RuntimeError("The library is closed.")
+            if (self.pool is None):
+                self.pool = ProcessPoolExecutor(self.workers,
+                    mp_context=multiprocessing.get_context(START))
+            return self.pool
+
+    ''' Indexable files of the directory, path: (size, mtime) '''
+    def Scan(self):
+        files = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if (not entry.name.lower().endswith(EXTENSIONS) or not entry.is_file()): continue
+                st = entry.stat()
+                files[entry.path] = (st.st_size, st.st_mtime_ns)
+        return files
+
+    ''' Update the index, returns the faces and backgrounds sorted by name,
+        each record with its path
+    '''
+    def Refresh(self):
+        files = self.Scan()
+        stale = []
+        for path, (size, mtime) in files.items():
+            record = self.index.Get(path)
+            if (record is None or record.get("size") != size or record.get("mtime") != mtime):
+                stale.append(path)
+        if (stale):
+            self.index.PutMany(zip(stale, self.Pool().map(Describe, stale, chunksize=8)))
+
+        # Forget files gone from the directory
+        gone = [path for path in self.index.Paths(self.directory) if path not in files]
+        if (gone): self.index.RemoveMany(gone)
+
+        entries = []
+        for path in sorted(files, key=lambda p: os.path.basename(p).lower()):
+            record = self.index.Get(path)
+            if (record and record.get("type")): entries.append(dict(record, path=path))
+        return entries
+
+    ''' Thumbnail of an entry, calls done(entry, (width, height, rgb)) from
+        a pool thread, or right away when cached
+    '''
+    def Thumbnail(self, entry, done):
+        key = (entry["sha256"], self.edge)
+        thumb = self.thumbs.Get(key)
+        if (thumb is not None):
+            done(entry, thumb)
+            return
+        if (self.closed): return
+
+        def Rendered(future):
+            if (future.cancelled() or future.exception() is not None): return
+            self.thumbs.Put(key, future.result())
+            done(entry, future.result())
+
+        self.Pool().submit(Render, entry["path"], entry, self.edge).add_done_callback(Rendered)
+
+    ''' Stop the workers, pending thumbnails are dropped '''
+    def Close(self):
+        with self.lock:
+            self.closed = True
+            pool, self.pool = self.pool, None
+        if (pool): pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,163 @@
+'''
+    DaFup link parameters: a fast connection for the length of a transfer.
+
+    Author: Vic <vicpt[at]protonmail.com>
+    Copyright (C) 2024 Vic
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+import re
+import asyncio
+
+
+''' Requested connection (BLE units) '''
+INTERVAL = (6, 12) # 7.5 to 15 ms, 1.25 ms units
+LATENCY  = 0       # Connection events the watch may skip
+TIMEOUT  = 200     # 2 s supervision timeout, 10 ms units
+
+''' BlueZ defaults, restored after the transfer '''
+DEFAULT  = (24, 40, 0, 42) # 30 to 50 ms, no latency, 420 ms timeout
+
+''' PHYs, HCI values '''
+PHYS  = {1: "1M", 2: "2M", 3: "Coded"}
+PHY1M = 0x01
+PHY2M = 0x02
+
+''' Seconds the controllers take to agree on new parameters '''
+SETTLE = 0.3
+
+
+''' Request a short connection interval and the 2M PHY for a transfer
+
+    Returns the link state for Restore and the summary: the method used
+    (winrt, android, hci or None when the platform offers none), and the
+    achieved interval in ms and PHY where the platform reports them, else
+    None. Nothing here fails a transfer, a refused request keeps the link
+    as it is.
+'''
+async def Tune(client, adapter=None):
+    state = {"method": None, "interval": None, "phy": None}
+    backend = type(getattr(client, "_backend", None)).__name__
+    try:
+        if (backend == "BleakClientWinRT"):
+            await TuneWinRT(client._backend, state)
+        elif (backend == "BleakClientP4Android"):
+            await TuneAndroid(client._backend, state)
+        elif (backend == "BleakClientBlueZDBus"):
+            await TuneHci(client.address, adapter, state)
+    except Exception:
+        pass
+    return state
+
+
+''' Back to the default parameters, before disconnecting '''
+async def Restore(client, state):
+    try:
+        if (state["method"] == "winrt"):
+            state.pop("request").close()
+        elif (state["method"] == "android"):
+            gatt = client._backend._BleakClientP4Android__gatt
+            gatt.requestConnectionPriority(0) # CONNECTION_PRIORITY_BALANCED
+            gatt.setPreferredPhy(PHY1M, PHY1M, 0)
+        elif (state["method"] == "hci"):
+            await Hci(state["adapter"], "lecup", "--handle", str(state["handle"]),
+                "--min", str(DEFAULT[0]), "--max", str(DEFAULT[1]),
+                "--latency", str(DEFAULT[2]), "--timeout", str(DEFAULT[3]))
+            await SetPhy(state["adapter"], state["handle"], PHY1M)
+    except Exception:
+        pass
+
+
+''' Link description for a summary line, empty when nothing is known '''
+def FormatLink(link):
+    if (not link): return ""
+    parts = []
+    if (link["interval"]): parts.append("%g ms interval" % link["interval"])
+    if (link["phy"]): parts.append(link["phy"] + " PHY")
+    if (not parts and link["method"]): parts.append("fast link requested")
+    return ", ".join(parts)
+
+
+''' Public fields of a link state '''
+def Achieved(state):
+    return {k: state[k] for k in ("method", "interval", "phy")}
+
+
+''' Windows: throughput optimized parameters, the system picks the PHY '''
+async def TuneWinRT(backend, state):
+    from winrt.windows.devices.bluetooth import BluetoothLEPreferredConnectionParameters
+    device = backend._requester
+    state["request"] = device.request_preferred_connection_parameters(
+        BluetoothLEPreferredConnectionParameters.throughput_optimized)
+    state["method"] = "winrt"
+    await asyncio.sleep(SETTLE)
+    state["interval"] = device.get_connection_parameters().connection_interval * 1.25
+    phy = device.get_connection_phy().transmit_info
+    state["phy"] = "2M" if phy.is_uncoded2_m_phy else "Coded" if phy.is_coded_phy else "1M"
+
+
+''' Android: high priority connection and the 2M PHY, neither is reported '''
+async def TuneAndroid(backend, state):
+    gatt = backend._BleakClientP4Android__gatt
+    gatt.requestConnectionPriority(1) # CONNECTION_PRIORITY_HIGH
+    state["method"] = "android"
+    gatt.setPreferredPhy(PHY2M, PHY2M, 0)
+
+
+''' BlueZ has no D-Bus call for either, hcitool asks the controller. It
+    needs root or CAP_NET_ADMIN, without them the link stays as it is.
+'''
+async def TuneHci(address, adapter, state):
+    code, out = await Hci(adapter, "con")
+    match = re.search(re.escape(address.upper()) + r" handle (\d+)", out)
+    if (code != 0 or match is None): return
+    handle = int(match.group(1))
+
+    code, out = await Hci(adapter, "lecup", "--handle", str(handle),
+        "--min", str(INTERVAL[0]), "--max", str(INTERVAL[1]),
+        "--latency", str(LATENCY), "--timeout", str(TIMEOUT))
+    if (code != 0 or "Could not" in out): return
+    state.update(method="hci", adapter=adapter, handle=handle)
+    await SetPhy(adapter, handle, PHY2M)
+    await asyncio.sleep(SETTLE)
+    state["phy"] = await ReadPhy(adapter, handle)
+
+
+''' Run hcitool, returns its exit code and output '''
+async def Hci(adapter, *args):
+    if (adapter): args = ("-i", adapter) + args
+    try:
+        proc = await asyncio.create_subprocess_exec("hcitool", *args,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+    except OSError:
+        return -1, ""
+    out, err = await proc.communicate()
+    return proc.returncode, out.decode("utf-8", "replace")
+
+
+''' HCI LE Set PHY of a connection, both directions '''
+async def SetPhy(adapter, handle, phy):
+    await Hci(adapter, "cmd", "0x08", "0x0032", "%02x" % (handle & 0xff), "%02x" % (handle >> 8),
+        "00", "%02x" % phy, "%02x" % phy, "00", "00")
+
+
+''' HCI LE Read PHY of a connection, the transmit PHY name or None '''
+async def ReadPhy(adapter, handle):
+    code, out = await Hci(adapter, "cmd", "0x08", "0x0030",
+        "%02x" % (handle & 0xff), "%02x" % (handle >> 8))
+    # Command complete: packets, opcode, status, handle, tx phy, rx phy
+    event = out.split("> HCI Event")[-1].splitlines()[1:]
+    data = bytes.fromhex(" ".join(event))
+    if (code != 0 or len(data) < 8 or data[3] != 0): return None
+    return PHYS.get(data[6])
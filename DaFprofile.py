@@ -0,0 +1,134 @@
+'''
+    DaFup profiler: CPU and memory profiles of the scan and upload paths.
+
+    Author: Vic <vicpt[at]protonmail.com>
+    Copyright (C) 2024 Vic
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+import os
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+import contextlib
+
+
+''' Profiler defaults '''
+TOP    = 15 # Functions and allocation sites in the summary
+FRAMES = 8  # Stack frames kept per allocation
+
+
+''' Phase profiler
+
+    Every phase gets a cProfile of the thread it runs on and a tracemalloc
+    snapshot at its start and end. Each phase writes <name>-<n>.prof (load
+    with pstats or snakeviz) and <name>-<n>.snapshot (tracemalloc.Snapshot.
+    load) to the directory, and summary.txt is rewritten with the hottest
+    functions and the top allocation sites of every phase so far.
+
+    cProfile only sees the thread it was enabled on before Python 3.12, so
+    a phase around a coroutine also covers whatever else the session loop
+    ran meanwhile. From 3.12 one profile covers every thread and a second
+    concurrent one can't start: that phase keeps its memory figures only.
+'''
+class Profiler:
+
+    def __init__(self, directory, top=TOP, frames=FRAMES):
+        self.directory = directory
+        self.top       = top
+        self.frames    = frames
+        self.lock      = threading.Lock()
+        self.counts    = {}
+        self.active    = 0
+        self.tracing   = False
+        self.sections  = []
+        os.makedirs(directory, exist_ok=True)
+
+    ''' Start a phase on the calling thread, returns it for End '''
+    def Begin(self, name):
+        with self.lock:
+            if (self.active == 0):
+                self.tracing = not tracemalloc.is_tracing()
+                if (self.tracing): tracemalloc.start(self.frames)
+                tracemalloc.reset_peak()
+            self.active += 1
+            self.counts[name] = self.counts.get(name, 0) + 1
+            phase = {"name": "%s-%d" % (name, self.counts[name])}
+        phase["before"] = tracemalloc.take_snapshot()
+        phase["profile"] = cProfile.Profile()
+        try:
+            phase["profile"].enable()
+        except ValueError:
+            phase["profile"] = None
+        phase["start"] = time.perf_counter()
+        return phase
+
+    ''' End a phase, on the thread that began it, and write its files '''
+    def End(self, phase):
+        seconds = time.perf_counter() - phase["start"]
+        profile = phase["profile"]
+        if (profile): profile.disable()
+        after = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        with self.lock:
+            self.active -= 1
+            if (self.active == 0 and self.tracing): tracemalloc.stop()
+
+        path = os.path.join(self.directory, phase["name"])
+        if (profile): profile.dump_stats(path + ".prof")
+        after.dump(path + ".snapshot")
+
+        # tracemalloc's own bookkeeping isn't the program's
+        ignore = (tracemalloc.Filter(False, tracemalloc.__file__),)
+        diff = after.filter_traces(ignore).compare_to(phase["before"].filter_traces(ignore), "lineno")
+        lines = ["== %s: %.3f s, %+.1f KiB allocated, peak %.1f KiB ==" % (phase["name"], seconds,
+            sum(s.size_diff for s in diff) / 1024, peak / 1024)]
+        lines += self.Hottest(profile)
+        lines.append("Top allocation sites (size change, count change, where):")
+        for stat in diff[:self.top]:
+            frame = stat.traceback[0]
+            lines.append("  %+10.1f KiB %+8d  %s:%d" % (stat.size_diff / 1024, stat.count_diff,
+                frame.filename, frame.lineno))
+
+        with self.lock:
+            self.sections.append("\n".join(lines))
+            with open(os.path.join(self.directory, "summary.txt"), "w") as fo:
+                fo.write("\n\n".join(self.sections) + "\n")
+        return seconds
+
+    ''' Summary lines of the functions with the most own time '''
+    def Hottest(self, profile):
+        if (profile is None): return ["No CPU profile, another profiler was running."]
+        stats = pstats.Stats(profile).stats
+        lines = ["Hottest functions (own s, total s, calls, function):"]
+        for (filen, line, func), (cc, calls, own, total, callers) in sorted(stats.items(),
+                key=lambda item: -item[1][2])[:self.top]:
+            lines.append("  %8.3f %8.3f %8d  %s:%d(%s)" % (own, total, calls, filen, line, func))
+        return lines
+
+    ''' Profile a block '''
+    @contextlib.contextmanager
+    def Phase(self, name):
+        phase = self.Begin(name)
+        try:
+            yield phase
+        finally:
+            self.End(phase)
+
+    ''' Run a coroutine as a phase, on the thread running its loop '''
+    async def Run(self, name, coro):
+        with self.Phase(name):
+            return await coro
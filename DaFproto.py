@@ -0,0 +1,120 @@
+'''
+    DaFup MoYoung v2 protocol: frame encoding and notification decoding.
+
+    Author: Vic <vicpt[at]protonmail.com>
+    Copyright (C) 2024 Vic
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+import struct
+from collections import namedtuple
+
+
+''' Frame layout: fe ea, 0x20 | length >> 8, length & 0xff, cmd, payload
+    The length counts the whole frame.
+'''
+MAGIC   = b"\xfe\xea"
+VERSION = 0x20
+HEADLEN = 5
+
+''' Commands '''
+CMDFACE     = 0x74 # Face transfer, also its notifications
+CMDBACK     = 0x6e # Background transfer, also its notifications
+CMDSETFACE  = 0x19 # Set watch face
+CMDSETBACK  = 0x29 # Set background transfer (unknown yet)
+CMDSETFACET = 0xb4 # Set face transfer (unknown yet)
+
+DONE   = 0xffffffff # Transfer notification index of a complete transfer
+MARKER = 0xff       # First payload byte of every complete notification
+
+''' Full 128 bit uuid of a 16 bit Bluetooth SIG uuid '''
+def Uuid16(uuid):
+    return "0000%04x-0000-1000-8000-00805f9b34fb" % uuid
+
+
+''' Notification events '''
+Request  = namedtuple("Request", "cmd index")     # Watch wants chunk index
+Complete = namedtuple("Complete", "cmd checksum") # Transfer done, checksum or None
+Message  = namedtuple("Message", "cmd payload")   # Any other frame
+
+
+''' Build a frame '''
+def Frame(cmd, payload=b""):
+    length = HEADLEN + len(payload)
+    return MAGIC + bytes((VERSION | (length >> 8), length & 0xff, cmd)) + payload
+
+
+''' Precomputed frames '''
+FACEFINISH = Frame(CMDFACE, bytes(4))
+BACKFINISH = Frame(CMDBACK, bytes(4))
+SETFACET   = Frame(CMDSETFACET, bytes.fromhex("1130040000"))
+SETBACK    = Frame(CMDSETBACK)
+SETFACE    = tuple(Frame(CMDSETFACE, bytes((face,))) for face in range(7))
+
+''' Headers of the frames carrying a length '''
+FACESEND = FACEFINISH[:-4]
+BACKSEND = BACKFINISH[:-4]
+_u32     = struct.Struct(">I")
+
+
+''' Face transfer cmd '''
+def cmdSendFace(length=0):
+    return FACESEND + _u32.pack(length)
+
+''' Face transfer finish signal cmd '''
+def cmdFaceTransferFinish():
+    return FACEFINISH
+
+''' Set face transfer cmd (unknown yet) '''
+def cmdSetFaceTransfer():
+    return SETFACET
+
+''' Background transfer cmd '''
+def cmdSendBackground(length=0):
+    return BACKSEND + _u32.pack(length)
+
+''' Background transfer finish signal cmd '''
+def cmdBackTransferFinish():
+    return BACKFINISH
+
+''' Set background transfer cmd (unknown yet) '''
+def cmdSetBackTransfer():
+    return SETBACK
+
+''' Set watch face '''
+def cmdSetFace(face=0):
+    if (face > 6): return 0
+
+    return SETFACE[face]
+
+
+''' Decode a notification into an event, None if it isn't a frame
+
+    Transfer notifications carry the 4 byte index the watch wants next.
+    One starting with MARKER completes the transfer, whatever follows it:
+    the checksum comes after a DONE index, some firmwares send none.
+'''
+def Decode(data):
+    if (len(data) < HEADLEN or data[0:2] != MAGIC): return None
+
+    length = ((data[2] & 0x0f) << 8) | data[3]
+    cmd = data[4]
+    payload = bytes(data[HEADLEN:max(length, HEADLEN)])
+    if (cmd in (CMDFACE, CMDBACK) and payload and payload[0] == MARKER):
+        done = len(payload) >= 8 and _u32.unpack_from(payload)[0] == DONE
+        return Complete(cmd, _u32.unpack_from(payload, 4)[0] if done else None)
+    if (cmd in (CMDFACE, CMDBACK) and len(payload) >= 4):
+        return Request(cmd, _u32.unpack_from(payload)[0])
+
+    return Message(cmd, payload)
@@ -0,0 +1,96 @@
+'''
+    DaFup streaming device scanner.
+
+    Author: Vic <vicpt[at]protonmail.com>
+    Copyright (C) 2024 Vic
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+import asyncio
+from DaFadapter import AdapterArgs
+from DaFproto import Uuid16
+
+
+''' Scan defaults '''
+SCANTIME = 5.0 # Longest scan (seconds)
+
+''' MoYoung advertisement rules, any match is enough '''
+SERVICES      = (Uuid16(0xfeea),)            # Advertised service uuids
+NAMES         = ()                           # Advertised name prefixes
+MANUFACTURERS = ()                           # Manufacturer data company ids
+
+
+''' Streaming scanner
+
+    Reports devices as they advertise, de-duplicated by address, keeping
+    only MoYoung looking ones unless unfiltered. The scan stops early once
+    the target address or `count` matches were found. Scans run on the
+    given adapter, the default one if None. `backend` replaces bleak's
+    BleakScanner, e.g. with the simulated one.
+'''
+class Scanner:
+
+    def __init__(self, timeout=SCANTIME, target="", count=0, unfiltered=False,
+                 known=(), found=None, adapter=None, backend=None):
+        self.timeout    = timeout
+        self.target     = target.upper()
+        self.count      = count
+        self.unfiltered = unfiltered
+        self.known      = set(a.upper() for a in known)
+        self.found      = found
+        self.adapter    = adapter
+        self.backend    = backend
+        self.devices    = {}
+        self.done       = asyncio.Event()
+
+    ''' Does the advertisement look like a MoYoung watch '''
+    def Match(self, device, adv):
+        if (self.unfiltered): return True
+        if (device.address.upper() in self.known): return True
+        if (any(uuid in SERVICES for uuid in adv.service_uuids)): return True
+        if (any(cid in MANUFACTURERS for cid in adv.manufacturer_data)): return True
+        name = adv.local_name or device.name or ""
+        return any(name.startswith(prefix) for prefix in NAMES)
+
+    ''' Detection callback '''
+    def OnDetect(self, device, adv):
+        address = device.address.upper()
+        if (address in self.devices):
+            # Keep the rssi fresh, already reported
+            self.devices[address][2] = adv.rssi
+            return
+        if (not self.Match(device, adv)): return
+
+        dev = [device.address, adv.local_name or device.name or "", adv.rssi]
+        self.devices[address] = dev
+        if (self.found): self.found(dev)
+
+        if (address == self.target or
+            (self.count and len(self.devices) >= self.count)):
+            self.done.set()
+
+    ''' Scan, returns [address, name, rssi] lists, strongest first '''
+    async def Run(self):
+        # bleak loads on the first scan
+        if (self.backend):
+            BleakScanner = self.backend
+        else:
+            from bleak import BleakScanner
+        async with BleakScanner(detection_callback=self.OnDetect, **AdapterArgs(self.adapter)):
+            try:
+                await asyncio.wait_for(self.done.wait(), self.timeout)
+            except asyncio.TimeoutError:
+                pass
+
+        return sorted(self.devices.values(), key=lambda dev: -dev[2])
@@ -0,0 +1,262 @@
+'''
+    DaFup BLE session manager, one event loop and reusable connections.
+
+    Author: Vic <vicpt[at]protonmail.com>
+    Copyright (C) 2024 Vic
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+import sys
+import asyncio
+import threading
+from typing import TYPE_CHECKING
+from DaFcore import Verify, Resolve, UploadError
+from DaFtelemetry import Phase
+from DaFadapter import AdapterArgs
+
+# bleak loads on first connection, only type checkers need it here
+if TYPE_CHECKING:
+    from bleak.backends.characteristic import BleakGATTCharacteristic
+
+
+''' Import bleak, it takes longer than everything else DaFup loads '''
+def Preload():
+    import bleak
+
+
+''' Whether an exception came from bleak, it can only once bleak is loaded '''
+def LinkError(e):
+    exc = sys.modules.get("bleak.exc")
+    return exc is not None and isinstance(e, exc.BleakError)
+
+
+''' Session defaults '''
+IDLE       = 60.0 # Seconds an unused connection is kept open
+RECONNECTS = 3    # Reconnects after losing the link mid upload
+BACKOFF    = 1.0  # Seconds before the first reconnect, doubled on each
+WARM       = 30.0 # Seconds a speculative connection waits to be used
+
+
+''' Verified, notify subscribed connection to one watch '''
+class Link:
+
+    def __init__(self, address):
+        self.address = address
+        self.adapter = None
+        self.client  = None
+        self.handler = None
+        self.handles = {}
+        self.timer   = None
+        self.warm    = False
+        self.lock    = asyncio.Lock()
+
+    ''' Connected and still usable '''
+    def Alive(self):
+        return self.client is not None and self.client.is_connected
+
+    ''' Function that handles service characteristic notification '''
+    def callback(self, sender: "BleakGATTCharacteristic", data: bytearray):
+        if (self.handler): self.handler(sender, data)
+
+    ''' Connection lost, reconnect on next use '''
+    def OnDisconnect(self, client):
+        self.client = None
+
+
+''' BLE session manager
+
+    Owns one event loop running in a daemon thread and keeps one Link per
+    watch, so consecutive operations on the same watch skip connecting,
+    service discovery and the manufacturer check. Unused links are closed
+    after IDLE seconds and dropped links reconnect on their next use.
+    Warm connects a watch likely to be used next, so its upload starts
+    streaming at once; Cool drops it again if it went unused.
+    Given a Devices cache, watches verified before reconnect with their
+    cached services and handles and without the manufacturer check. An
+    upload losing its link reconnects after a growing delay and resumes
+    from its Checkpoints where the watch allows it, or starts over; other
+    failures are raised for the caller to retry. Given an Assets cache,
+    files the watch already holds are applied without a transfer. Given
+    a Telemetry, connections and uploads report their phases to it.
+    Uploads ask for a fast link while streaming unless `tune` is False.
+    `client` replaces bleak's BleakClient, e.g. with the simulated watch.
+'''
+class Session:
+
+    def __init__(self, idle=IDLE, devices=None, checkpoints=None, assets=None,
+                 telemetry=None, tune=True, client=None):
+        self.idle    = idle
+        self.devices = devices
+        self.checkpoints = checkpoints
+        self.assets  = assets
+        self.telemetry = telemetry
+        self.tune    = tune
+        self.client  = client
+        self.links   = {}
+        self.loop    = asyncio.new_event_loop()
+        self.thread  = threading.Thread(target=self.loop.run_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    ''' Load bleak on the session thread while nothing else runs there, so
+        the first scan or connection doesn't wait for it
+    '''
+    def Preload(self):
+        self.loop.call_soon_threadsafe(Preload)
+
+    ''' Run a coroutine on the session loop, waits for the result '''
+    def Run(self, coro):
+        return self.Submit(coro).result()
+
+    ''' Run a coroutine on the session loop, returns a future '''
+    def Submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    ''' Speculatively connect a watch, the link closes when unused for the
+        warm time
+    '''
+    async def Warm(self, address, adapter=None, idle=WARM):
+        link = self.Get(address)
+        async with link.lock:
+            if (link.Alive()): return link
+            link.adapter = adapter
+            await self.Connect(link)
+            link.warm = True
+            self.Idle(link, idle)
+
+        return link
+
+    ''' Drop a speculative connection that wasn't used, waits for a running
+        connection or upload to end first
+    '''
+    async def Cool(self, address):
+        link = self.links.get(address)
+        if (link is None): return
+        async with link.lock:
+            if (link.warm): await self.Drop(address)
+
+    ''' Link record of a watch '''
+    def Get(self, address):
+        if (address not in self.links):
+            self.links[address] = Link(address)
+        return self.links[address]
+
+    ''' Connect and verify a link, the caller holds its lock '''
+    async def Connect(self, link):
+        if (link.timer): link.timer.cancel()
+        if (link.Alive()): return
+
+        record = self.devices.Get(link.address) if self.devices else None
+        cached = record is not None and record.get("verified", False)
+        if (self.client):
+            BleakClient = self.client
+        else:
+            from bleak import BleakClient
+        client = BleakClient(link.address, disconnected_callback=link.OnDisconnect,
+            services=record.get("services") if cached else None,
+            **AdapterArgs(link.adapter))
+        try:
+            with Phase(self.telemetry, "connect", address=link.address, cached=cached):
+                await client.connect()
+        except Exception:
+            raise UploadError("Can't connect to device.")
+        try:
+            if (not cached):
+                with Phase(self.telemetry, "manufacturer", address=link.address):
+                    await Verify(client)
+            handles, services = Resolve(client)
+            if ("ctr" not in handles or "snd" not in handles or "nty" not in handles):
+                raise UploadError("It doesn't look a MOYOUNG-V2 compatible device.")
+            with Phase(self.telemetry, "start_notify", address=link.address):
+                await client.start_notify(handles["nty"], link.callback)
+        except BaseException as e:
+            await client.disconnect()
+            # Cancelled connections are given up, not retried
+            if (not cached or not isinstance(e, Exception)): raise
+            # Stale cache entry, verify the watch again
+            self.devices.Remove(link.address)
+            return await self.Connect(link)
+        link.client = client
+        link.handles = handles
+        if (self.devices):
+            self.devices.Put(link.address, verified=True, services=services, handles=handles)
+
+    ''' Close the link once it was unused for the idle time, the session one
+        by default
+    '''
+    def Idle(self, link, idle=None):
+        if (link.timer): link.timer.cancel()
+        link.timer = self.loop.call_later(self.idle if idle is None else idle,
+            lambda: asyncio.ensure_future(self.Drop(link.address)))
+
+    ''' Run an Upload over the watch link '''
+    async def Upload(self, upload):
+        if (upload.checkpoints is None): upload.checkpoints = self.checkpoints
+        if (upload.assets is None): upload.assets = self.assets
+        if (upload.telemetry is None): upload.telemetry = self.telemetry
+        if (upload.tune is None): upload.tune = self.tune
+        for attempt in range(RECONNECTS + 1):
+            if (attempt): await asyncio.sleep(BACKOFF * 2 ** (attempt - 1))
+            link = self.Get(upload.address)
+            # A live link stays on its adapter
+            if (not link.Alive()): link.adapter = upload.adapter
+            async with link.lock:
+                await self.Connect(link)
+                link.warm = False
+                link.handler = upload.callback
+                upload.handles = link.handles
+                record = self.devices.Get(link.address) if self.devices else None
+                if (record and not upload.probe): upload.chunk = record.get("chunk", 0)
+                try:
+                    summary = await upload.Run(link.client)
+                except Exception as e:
+                    # The watch state is unknown, start over next time
+                    link.handler = None
+                    lost = not link.Alive() or LinkError(e)
+                    await self.Drop(link.address)
+                    if (isinstance(e, UploadError) or not lost or attempt == RECONNECTS): raise
+                    if (upload.status): upload.status("Link lost, reconnecting...")
+                    if (self.telemetry): self.telemetry.Count("reconnects_total")
+                    continue
+                link.handler = None
+                self.Idle(link)
+                if (self.devices):
+                    fields = {"chunk": summary["chunk"]}
+                    # Measured rate, for planning the next transfers
+                    if (summary["rate"]): fields["rate"] = summary["rate"]
+                    if (upload.name): fields["name"] = upload.name
+                    self.devices.Put(link.address, **fields)
+
+                return summary
+
+    ''' Disconnect a watch link '''
+    async def Drop(self, address):
+        link = self.links.pop(address, None)
+        if (link is None): return
+        if (link.timer): link.timer.cancel()
+        if (link.Alive()):
+            with Phase(self.telemetry, "disconnect", address=address):
+                await link.client.disconnect()
+
+    ''' Disconnect all links '''
+    async def DropAll(self):
+        await asyncio.gather(*[self.Drop(address) for address in list(self.links)])
+
+    ''' Disconnect all links and stop the loop '''
+    def Close(self, timeout=5.0):
+        try:
+            self.Submit(self.DropAll()).result(timeout)
+        except Exception:
+            pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
@@ -0,0 +1,250 @@
+'''
+    DaFup simulated MoYoung v2 watch, an in-process stand in for BleakClient.
+
+    Author: Vic <vicpt[at]protonmail.com>
+    Copyright (C) 2024 Vic
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+import os
+import time
+import zlib
+import atexit
+import random
+import shutil
+import asyncio
+import tempfile
+from DaFcore import CTRCHAR, SNDCHAR, NTYCHAR, MANCHAR, MANUFACTURER
+from DaFproto import CMDFACE, CMDBACK, DONE, MARKER, Frame, Decode, Message
+from DaFscan import SERVICES
+
+
+''' Simulation defaults '''
+MTU     = 247    # Negotiated ATT MTU
+LATENCY = 0.002  # Seconds the watch takes to store one chunk
+NOTIFY  = 0.001  # Seconds from storing a chunk to its notification
+LOSS    = 0.0    # Probability a chunk is lost on air
+BUFFER  = 8      # Chunks the watch buffers before refusing writes
+
+''' Watches the simulated scanner finds, (address, name, rssi) '''
+WATCHES = (("DA:F0:00:00:00:01", "SimWatch 1", -40), ("DA:F0:00:00:00:02", "SimWatch 2", -60))
+
+
+''' Characteristic of the simulated GATT table '''
+class Characteristic:
+
+    def __init__(self, uuid, handle):
+        self.uuid = uuid
+        self.handle = handle
+        self.service_uuid = uuid
+
+
+''' Simulated GATT table '''
+class Services:
+
+    def __init__(self):
+        self.chars = {}
+        for handle, uuid in enumerate((CTRCHAR, SNDCHAR, NTYCHAR, MANCHAR), 16):
+            char = Characteristic(uuid, handle)
+            self.chars[uuid] = self.chars[handle] = char
+
+    def get_characteristic(self, specifier):
+        return self.chars.get(specifier)
+
+
+''' Simulated watch
+
+    Accepts the same calls the uploader makes on a BleakClient, and its
+    constructor takes BleakClient's arguments, so a Session can use it in
+    place of bleak's. Chunks are
+    queued and stored one every `latency` seconds; a full queue refuses
+    writes with response like a busy controller and loses the ones
+    without, like an overrun watch, which asks for them again if it
+    notifies. Stored chunks are acknowledged with the
+    next index wanted, lost ones are asked for again once the rest is in,
+    and a complete file is confirmed with its CRC-32, or with the bare
+    MARKER frame older firmwares send when `marker`. A silent watch never
+    notifies.
+'''
+class SimClient:
+
+    def __init__(self, address="00:00:00:00:00:00", disconnected_callback=None,
+                 services=None, mtu=MTU, latency=LATENCY, notify=NOTIFY,
+                 loss=LOSS, buffer=BUFFER, silent=False, marker=False, seed=None, bluez=None):
+        self.address  = address
+        self.mtu_size = mtu
+        self.latency  = latency
+        self.notify   = notify
+        self.loss     = loss
+        self.buffer   = buffer
+        self.silent   = silent
+        self.marker   = marker
+        self.random   = random.Random(seed)
+        self.services = Services()
+        self.is_connected = False
+        self.disconnected_callback = disconnected_callback
+        self.callback = None
+        self.queue    = None
+        self.worker   = None
+        self.Reset(0)
+
+    ''' Start receiving a file of size bytes '''
+    def Reset(self, size, cmd=CMDFACE):
+        self.size     = size
+        self.cmd      = cmd
+        self.chunks   = []
+        self.lost     = set()
+        self.asked    = []
+        self.done     = False
+        self.latencies = []
+
+    async def connect(self, **kwargs):
+        self.is_connected = True
+        self.queue = asyncio.Queue()
+        self.worker = asyncio.ensure_future(self.Store())
+        return True
+
+    async def disconnect(self):
+        # Writes already queued still reach the watch
+        if (self.worker):
+            await self.queue.join()
+            self.worker.cancel()
+        self.is_connected = False
+        if (self.disconnected_callback): self.disconnected_callback(self)
+        return True
+
+    async def read_gatt_char(self, char):
+        if (self.Uuid(char) == MANCHAR): return bytearray(MANUFACTURER.encode("utf-8"))
+        raise Exception("Characteristic not readable")
+
+    async def start_notify(self, char, callback, **kwargs):
+        self.callback = callback
+
+    async def stop_notify(self, char):
+        self.callback = None
+
+    async def write_gatt_char(self, char, data, response=False):
+        if (not self.is_connected): raise Exception("Not connected")
+        uuid = self.Uuid(char)
+        if (uuid == CTRCHAR):
+            self.Control(bytes(data))
+        elif (uuid == SNDCHAR):
+            if (len(data) > self.mtu_size - 3): raise Exception("Write larger than the MTU")
+            if (self.queue.qsize() >= self.buffer):
+                if (response): raise Exception("Buffer full")
+                return
+            self.queue.put_nowait((bytes(data), time.monotonic()))
+
+    ''' Uuid of a uuid or handle '''
+    def Uuid(self, char):
+        found = self.services.get_characteristic(char)
+        return found.uuid if found else char
+
+    ''' Control command '''
+    def Control(self, data):
+        event = Decode(data)
+        if (isinstance(event, Message) or event is None): return
+        # Start commands carry the size, finish commands carry zero
+        size = int.from_bytes(data[5:9], "big")
+        if (event.cmd in (CMDFACE, CMDBACK) and size):
+            self.Reset(size, event.cmd)
+            self.Notify(0)
+
+    ''' Store queued chunks, one per latency '''
+    async def Store(self):
+        while (True):
+            data, written = await self.queue.get()
+            await asyncio.sleep(self.latency)
+            if (self.asked):
+                # Resent chunk, fills the oldest gap asked for
+                index = self.asked.pop(0)
+                self.chunks[index] = data
+            else:
+                index = len(self.chunks)
+                self.chunks.append(data)
+            if (self.random.random() < self.loss):
+                self.lost.add(index)
+            else:
+                self.lost.discard(index)
+            self.latencies.append(time.monotonic() - written + self.notify)
+            self.Progress()
+            self.queue.task_done()
+
+    ''' Acknowledge, ask for a missing chunk or confirm the file '''
+    def Progress(self):
+        if (sum(len(c) for c in self.chunks) < self.size):
+            self.Notify(len(self.chunks))
+        elif (self.lost):
+            # All sent, ask for the first gap again
+            if (not self.asked): self.asked.append(min(self.lost))
+            self.Notify(self.asked[0])
+        else:
+            self.done = True
+            if (self.marker):
+                self.Notify(MARKER << 24)
+            else:
+                self.Notify(DONE, zlib.crc32(b"".join(self.chunks)))
+
+    ''' Send a transfer notification '''
+    def Notify(self, index, checksum=None):
+        if (self.silent or self.callback is None): return
+        payload = index.to_bytes(4, "big")
+        if (checksum is not None): payload += checksum.to_bytes(4, "big")
+        frame = bytearray(Frame(self.cmd, payload))
+        asyncio.get_running_loop().call_later(self.notify, self.callback, NTYCHAR, frame)
+
+
+''' Advertisement of a simulated watch, as a BLEDevice and AdvertisementData '''
+class Advertisement:
+
+    def __init__(self, address, name, rssi):
+        self.address    = address
+        self.name       = name
+        self.local_name = name
+        self.rssi       = rssi
+        self.service_uuids = list(SERVICES)
+        self.manufacturer_data = {}
+
+
+''' Simulated BleakScanner, every one of WATCHES advertises once shortly
+    after the scan starts
+'''
+class SimScanner:
+
+    def __init__(self, detection_callback=None, bluez=None, **kwargs):
+        self.detection_callback = detection_callback
+        self.timers = []
+
+    async def __aenter__(self):
+        loop = asyncio.get_running_loop()
+        for i, watch in enumerate(WATCHES):
+            adv = Advertisement(*watch)
+            self.timers.append(loop.call_later(NOTIFY * 10 * (i + 1),
+                self.detection_callback, adv, adv))
+        return self
+
+    async def __aexit__(self, *args):
+        for timer in self.timers:
+            timer.cancel()
+
+
+''' Move the caches to a temporary directory, removed at exit, so
+    simulated watches never reach the real ones. Call before creating any
+    cache store.
+'''
+def Sandbox():
+    path = tempfile.mkdtemp(prefix="dafup-sim-")
+    os.environ["XDG_CACHE_HOME"] = path
+    atexit.register(shutil.rmtree, path, True)
+    return path
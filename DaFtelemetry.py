@@ -0,0 +1,169 @@
+'''
+    DaFup telemetry: structured events, histograms and a metrics endpoint.
+
+    Author: Vic <vicpt[at]protonmail.com>
+    Copyright (C) 2024 Vic
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+import json
+import time
+import bisect
+import threading
+import contextlib
+
+
+''' Histogram bucket upper bounds (seconds) '''
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+''' Metric name prefix '''
+PREFIX = "dafup_"
+
+
+''' Cumulative histogram, Prometheus style '''
+class Histogram:
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts  = [0] * (len(buckets) + 1)
+        self.sum     = 0
+        self.count   = 0
+
+    def Observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+''' Telemetry sink
+
+    Events go to a JSON-lines log, one object per line with its time and
+    name. Observations feed histograms and counts feed counters, both
+    exported in the Prometheus text format. Chunk events are only logged
+    when `chunks` is set, their timings always reach the histograms.
+    Safe to use from any thread.
+'''
+class Telemetry:
+
+    def __init__(self, log=None, chunks=False):
+        self.log        = open(log, "a", buffering=1) if log else None
+        self.chunks     = chunks
+        self.lock       = threading.Lock()
+        self.histograms = {}
+        self.counters   = {}
+        self.server     = None
+
+    ''' Log an event '''
+    def Event(self, name, **fields):
+        if (self.log is None): return
+        line = json.dumps(dict({"t": round(time.time(), 6), "event": name}, **fields))
+        with self.lock:
+            self.log.write(line + "\n")
+
+    ''' Log a chunk event, if chunks are logged '''
+    def Chunk(self, name, **fields):
+        if (self.chunks): self.Event(name, **fields)
+
+    ''' Add a value to a histogram '''
+    def Observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            if (key not in self.histograms): self.histograms[key] = Histogram()
+            self.histograms[key].Observe(value)
+
+    ''' Add to a counter '''
+    def Count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    ''' Metrics in the Prometheus text format '''
+    def Prometheus(self):
+        lines = []
+        with self.lock:
+            for name in sorted({k[0] for k in self.counters}):
+                lines.append("# TYPE %s%s counter" % (PREFIX, name))
+                for key in sorted(k for k in self.counters if k[0] == name):
+                    lines.append("%s%s%s %s" % (PREFIX, name, Labels(key[1]), self.counters[key]))
+            for name in sorted({k[0] for k in self.histograms}):
+                lines.append("# TYPE %s%s histogram" % (PREFIX, name))
+                for key in sorted(k for k in self.histograms if k[0] == name):
+                    hist = self.histograms[key]
+                    total = 0
+                    for bound, count in zip(hist.buckets + ("+Inf",), hist.counts):
+                        total += count
+                        labels = key[1] + (("le", str(bound)),)
+                        lines.append("%s%s_bucket%s %d" % (PREFIX, name, Labels(labels), total))
+                    lines.append("%s%s_sum%s %.6f" % (PREFIX, name, Labels(key[1]), hist.sum))
+                    lines.append("%s%s_count%s %d" % (PREFIX, name, Labels(key[1]), hist.count))
+        return "\n".join(lines) + "\n"
+
+    ''' Serve the metrics over HTTP from a daemon thread '''
+    def Serve(self, port, host="127.0.0.1"):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        telemetry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = telemetry.Prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self.server
+
+    ''' Stop serving and close the log '''
+    def Close(self):
+        if (self.server): self.server.shutdown()
+        if (self.log): self.log.close()
+        self.server = self.log = None
+
+
+''' Prometheus label set '''
+def Labels(labels):
+    if (not labels): return ""
+    return "{" + ",".join('%s="%s"' % (k, str(v).replace('"', '\\"')) for k, v in labels) + "}"
+
+
+''' Time a phase: logs it with its outcome and feeds the phase histogram.
+    A None telemetry times nothing.
+'''
+@contextlib.contextmanager
+def Phase(telemetry, name, **fields):
+    if (telemetry is None):
+        yield
+        return
+
+    start = time.monotonic()
+    try:
+        yield
+    except BaseException as e:
+        seconds = time.monotonic() - start
+        telemetry.Event("phase", phase=name, seconds=round(seconds, 6), error=repr(e), **fields)
+        telemetry.Observe("phase_seconds", seconds, phase=name)
+        telemetry.Count("phase_errors_total", phase=name)
+        raise
+    seconds = time.monotonic() - start
+    telemetry.Event("phase", phase=name, seconds=round(seconds, 6), **fields)
+    telemetry.Observe("phase_seconds", seconds, phase=name)
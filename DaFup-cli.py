@@ -20,19 +20,47 @@
     You should have received a copy of the GNU General Public License
     along with this program.  If not, see <https://www.gnu.org/licenses/>.
 '''
-import os
+import sys
+import json
 import asyncio
-from bleak import BleakScanner, BleakClient
-from bleak.backends.characteristic import BleakGATTCharacteristic
-from bleak.uuids import normalize_uuid_16
-import threading
+import argparse
+from DaFcore import Payload, Upload, UploadError, FormatRate
+from DaFsession import Session
+from DaFcache import Devices, Checkpoints, Assets
+from DaFscan import Scanner
+from DaFbatch import Batch, LIMIT, RETRIES
+from DaFformat import Validate, Plan, FormatPlan
+from DaFimage import IsImage, Convert, ParsePanel, PANEL
+from DaFtelemetry import Telemetry
+from DaFadapter import Adapters
+from DaFlink import FormatLink
 
 
-''' Main characteristic uuids '''
-CTRCHAR = normalize_uuid_16(0xfee2) # Write (no response)
-SNDCHAR = normalize_uuid_16(0xfee6) # Send data
-NTYCHAR = normalize_uuid_16(0xfee3) # Notify
-MANCHAR = normalize_uuid_16(0x2a29) # Manufacturer name
+''' Upload types of the non-interactive mode '''
+TYPES = ("face", "background")
+
+
+''' Read a jobs file, a JSON list of {"address", "type", "file"}, each job
+    may pin an "adapter" too
+'''
+def LoadJobs(filen):
+    try:
+        with open(filen, "r") as fo:
+            jobs = json.load(fo)
+    except (OSError, ValueError) as e:
+        raise ValueError("Can't read jobs file: " + str(e))
+    
+    if (not isinstance(jobs, list)):
+        raise ValueError("Jobs file must hold a list of jobs")
+    for job in jobs:
+        if (not isinstance(job, dict) or
+            not all(isinstance(job.get(k), str) for k in ("address", "type", "file"))):
+            raise ValueError("Every job needs an address, a type and a file")
+        if (job["type"] not in TYPES):
+            raise ValueError("Job type must be face or background")
+        if (not isinstance(job.get("adapter", ""), str)):
+            raise ValueError("Job adapter must be a name like hci0")
+    return jobs
 
 
 ''' Main Window '''
@@ -40,31 +68,67 @@ class DaFup:
     
     def __init__(self):
         self.DevSelected = ""
+        self.DevName = ""
         self.FileSelected = ""
-        self.NotifyData = ""
+        self.DevBatch = []
         self.liststore = []
         self.IsFace = False
         self.IsBackground = False
+        self.ProbeChunk = False
+        self.ScanAll = False
+        self.ScanCount = 0
+        self.Batch = False
+        self.BatchLimit = LIMIT
+        self.BatchRetries = RETRIES
+        self.Json = False
+        self.Force = False
+        self.Check = True
+        self.Panel = PANEL
+        self.Adapters = []
+        self.ScanAdapter = None
+        self.ScanBackend = None
+        self.devices = Devices()
+        self.telemetry = None
+        self.profiler = None
+        self.session = Session(devices=self.devices, checkpoints=Checkpoints(),
+            assets=Assets())
 
     '''Main method'''
     def main(self):
-        self.search_request()
+        # Known watches connect without a scan
+        if (self.devices.Known()):
+            self.known_request()
+        else:
+            self.search_request()
         
         #Select device menu
         mstatus = False
         while not mstatus:
-            n = input("Select device to connect or [s] for new search [q] to Quit): ")
+            if (self.Batch):
+                n = input("Select devices to connect separated by commas, [a] for all or [s] for new search [q] to Quit): ")
+            else:
+                n = input("Select device to connect or [s] for new search [q] to Quit): ")
             if (n == 's'):
                 self.search_request()
             elif (n == 'q'):
                 quit()
-            elif (n.isdigit()):
+            elif (self.Batch and n == 'a'):
+                n = ",".join(str(i) for i in range(0, len(self.liststore)))
+                mstatus = True
+            elif (n.replace(",", "").isdigit() and (self.Batch or n.isdigit())):
                 mstatus = True
             else:
                 print ("Need to be a number, s or q")
+            if (mstatus and (not n.strip(",") or
+                any(int(i) >= len(self.liststore) for i in n.split(",") if i))):
+                print ("Need to be a listed device number")
+                mstatus = False
         
-        print (self.liststore[int(n)][0] + " selected.")
-        self.DevSelected = self.liststore[int(n)][0]
+        self.DevBatch = [self.liststore[int(i)] for i in n.split(",") if i]
+        for dev in self.DevBatch:
+            print (dev[0] + " selected.")
+        self.DevSelected = self.DevBatch[0][0]
+        self.DevName = self.DevBatch[0][1]
         
         #Select file type menu
         self.IsBackground = False
@@ -96,175 +160,110 @@ class DaFup:
             if (n == 'q'):
                 quit()
             else:
-                if (os.path.exists(n)):
+                # Bad files are turned down before connecting
+                payload = self.OpenFile(n)
+                if (payload is not None):
+                    payload.Close()
                     self.FileSelected = n
                     mstatus = True
-                else:
-                    print ("[ERROR] Error opening the file.")
         
         print (n + " selected.")
         
         self.upload_request()
     
     ''' Discover bluetooth devices '''
-    async def Discover(self):
-        #Scanning for 5 seconds...
-        devices = await BleakScanner.discover(
-        return_adv=True)
-        
-        return devices
+    async def Discover(self, found=None):
+        # Scanning for up to 5 seconds, devices are reported as found
+        scanner = Scanner(count=self.ScanCount, unfiltered=self.ScanAll,
+            known=[dev[0] for dev in self.devices.Known()], found=found,
+            adapter=self.ScanAdapter, backend=self.ScanBackend)
+        return await scanner.Run()
 
     ''' Connect to device '''
     async def DoConnect(self):
-        # Main connection
-        client = BleakClient(self.DevSelected)
-        try:
-            await client.connect()
-        except:
-            print ("[ERROR] Can't connect to device.")
-            return
+        # Open the file to send
+        payload = self.OpenFile(self.FileSelected)
+        if (payload is None): return
         
-        # Check if device has a moyoung manufacturer characteristic
+        record = self.devices.Get(self.DevSelected) or {}
+        print (FormatPlan(Plan(payload, record.get("chunk"), record.get("rate"))))
+        upload = Upload(self.DevSelected, payload, self.IsBackground,
+            self.DevName, self.ProbeChunk, self.OnProgress, print, force=self.Force,
+            adapter=self.Adapters[0] if self.Adapters else None)
         try:
-            manfact = await client.read_gatt_char(MANCHAR)
-        except:
-            print ("[ERROR] It doesn't look a MOYOUNG-V2 compatible device.")
+            summary = await self.session.Upload(upload)
+        except UploadError as e:
+            print ("[ERROR] " + str(e))
             return
-        
-        # Check if device manufacturer characteristic reads as a moyoung
-        if (manfact.decode("utf-8") != "MOYOUNG-V2"):
-            await client.disconnect()
-            print ("[ERROR] It doesn't look a MOYOUNG-V2 compatible device.")
+        except Exception as e:
+            print ("[ERROR] Upload failed: " + str(e))
             return
+        finally:
+            payload.Close()
             
-        # Start notify system, self.callback() handle it
-        await client.start_notify(NTYCHAR, self.callback)
-            
-        # Open the file to send
-        fsize, flist = self.OpenFile(self.FileSelected)
-            
-        # Background or watch face
-        if (self.IsBackground):
-            cmd = self.cmdSendBackground(fsize)
-        else:
-            cmd = self.cmdSendFace(fsize)
-        # Send start transfer command
-        await client.write_gatt_char(CTRCHAR, cmd, response=False)
-        await asyncio.sleep(0.5)
-            
-        print ("Transferring...")
-        progress = 0
-        # Start transfer, while not get "feea200974ff"
-        while (self.NotifyData[0:6] != b"\xfe\xea\x20\x09\x74\xff"):
-            for i in range(0, len(flist)):
-                await client.write_gatt_char(SNDCHAR, flist[i], response=False)
-                progress += 100/len(flist)
-                print (str(int(progress)) + "%")
-                await asyncio.sleep(0.3)
-            break
-            #It will break after transfer complete. Need to find out how the
-            #checksum is made to then do a proper checksum comparison.
-            
-        # Send finish command
-        # Background or watch face
-        if (self.IsBackground):
-            cmd = self.cmdBackTransferFinish()
-            await client.write_gatt_char(CTRCHAR, cmd, response=False)
-            cmd = self.cmdSetBackTransfer()
-            await client.write_gatt_char(CTRCHAR, cmd, response=False)
-            cmd = self.cmdSetFace(1)
-            await client.write_gatt_char(CTRCHAR, cmd, response=False)
-        else:
-            cmd = self.cmdFaceTransferFinish()
-            await client.write_gatt_char(CTRCHAR, cmd, response=False)
-            cmd = self.cmdSetFaceTransfer()
-            await client.write_gatt_char(CTRCHAR, cmd, response=False)
-            cmd = self.cmdSetFace(6)
-            await client.write_gatt_char(CTRCHAR, cmd, response=False)
-            
-        await client.disconnect()
-        print ("\nTransfer complete.")
-            
-    ''' Function that handles service characteristic notification '''
-    def callback(self, sender: BleakGATTCharacteristic, data: bytearray):
-        self.NotifyData = data        
+        if (summary["skipped"]):
+            print ("Already on the watch, applied without a transfer.")
+            return
+        link = FormatLink(summary["link"])
+        print ("\nTransfer complete, " + FormatRate(summary["rate"]) +
+        " with " + str(summary["chunk"]) + " bytes chunks" + (", " + link if link else "") +
+        (", checksum verified." if summary["verified"] else
+         ", checksum didn't match." if summary["verified"] is False else "."))
+    
+    ''' Upload to all batch devices '''
+    async def DoBatch(self):
+        payload = self.OpenFile(self.FileSelected)
+        if (payload is None): return
+        
+        batch = Batch(self.DevBatch, payload, self.IsBackground, self.ProbeChunk,
+            self.BatchLimit, self.BatchRetries, progress=self.OnProgress, status=print,
+            session=self.session, force=self.Force, adapters=self.Adapters)
+        try:
+            report = await batch.Run()
+        finally:
+            payload.Close()
+        
+        print ("\nBatch complete, " + str(report["done"]) + " of " +
+        str(report["devices"]) + " devices in " + str(report["seconds"]) + "s, " +
+        FormatRate(report["rate"]) + ".")
+        for address in report["results"]:
+            result = report["results"][address]
+            if ("error" in result):
+                print (address + " [ERROR] " + result["error"])
+            else:
+                print (address + " " + FormatRate(result["rate"]))
     
-    ''' Open a file for send '''
+    ''' Transfer progress '''
+    def OnProgress(self, sent, total):
+        print (str(int(sent * 100 / total)) + "%")
+    
+    ''' Open and check a file for send '''
     def OpenFile(self, filen=""):
         if (filen == ""): return
+        # Images become backgrounds of the watch format
+        if (self.IsBackground and IsImage(filen)):
+            try:
+                filen = Convert(filen, self.Panel)
+            except UploadError as e:
+                print ("[ERROR] " + str(e))
+                return
         try:
-            # Open and divide the file in chunks
-            fo = open(filen, "rb")
+            # Map the file, the transfer reads it in chunks
+            payload = Payload(filen)
         except:
             print ("[ERROR] Error opening the file.")
+            return
+        
+        if (self.Check):
+            try:
+                Validate(payload, self.IsBackground)
+            except UploadError as e:
+                payload.Close()
+                print ("[ERROR] " + str(e))
+                return
 
-        chunk = 512
-        flist = []
-        while (True):
-            data = fo.read(chunk)
-            if (data == b''): break
-            flist.append(data)
-
-        fo.seek(0,0)
-        fsize = len(fo.read())
-        fo.close()
-    
-        return fsize, flist
-    
-    ''' Face transfer cmd '''
-    def cmdSendFace(self, length=0):
-        header  = bytes.fromhex("feea200974")
-        length  = length.to_bytes(4)
-    
-        cmd = (header + length)
-        return cmd
-    
-    ''' Face transfer finish signal cmd '''
-    def cmdFaceTransferFinish(self):
-        header  = bytes.fromhex("feea20097400000000")
-    
-        cmd = header
-        return cmd
+        return payload
     
-    ''' Set face transfer cmd (unknown yet) '''
-    def cmdSetFaceTransfer(self):
-        header  = bytes.fromhex("feea200ab41130040000")
-    
-        cmd = header
-        return cmd
-    
-    ''' Background transfer cmd '''
-    def cmdSendBackground(self, length=0):
-        header  = bytes.fromhex("feea20096e")
-        length  = length.to_bytes(4)
-    
-        cmd = (header + length)
-        return cmd
-    
-    ''' Background transfer finish signal cmd '''
-    def cmdBackTransferFinish(self):
-        header  = bytes.fromhex("feea20096e00000000")
-    
-        cmd = header
-        return cmd
-    
-    ''' Set background transfer cmd (unknown yet) '''
-    def cmdSetBackTransfer(self):
-        header  = bytes.fromhex("feea200529")
-    
-        cmd = header
-        return cmd
-    
-    ''' Set watch face '''
-    def cmdSetFace(self, face=0):
-        if (face > 6): return 0
-    
-        header  = bytes.fromhex("feea200619")
-        face    = face.to_bytes(1)
-    
-        cmd = (header + face)
-        return cmd
-        
     '''On search request'''
     def search_request(self):
         print ("Searching for devices, please wait...")
@@ -272,14 +271,15 @@ class DaFup:
         self.liststore.clear()
         d = 0
         try:
-            devices = asyncio.run(self.Discover())
+            devices = self.Run("scan", self.Discover(self.OnFound))
         except Exception:
             print ("[ERROR] Can't access Bluetooth.")
             quit()
             
-        for x in devices:
-            devlist = str(devices[x][0]).split(': ')
-            self.liststore.append([devlist[0], devlist[1]])
+        # Strongest signal first
+        for dev in devices:
+            self.liststore.append([dev[0], dev[1]])
+            self.devices.Update(dev[0], name=dev[1], rssi=dev[2])
             d += 1
         
         #List the devices
@@ -290,12 +290,243 @@ class DaFup:
         
         print ("\nScan complete, " + str(d) + " devices found")
     
+    '''Device found while searching'''
+    def OnFound(self, dev):
+        print ("Found " + dev[0] + " - " + dev[1] + " (" + str(dev[2]) + " dBm)")
+    
+    '''List known devices'''
+    def known_request(self):
+        self.liststore.clear()
+        self.liststore.extend(self.devices.Known())
+        
+        for i in range(0, len(self.liststore)):
+            print ('----------------------------------------')
+            print ("[" + str(i) + "] " + self.liststore[i][0] +
+            " - " +self.liststore[i][1])
+        
+        print ("\n" + str(len(self.liststore)) + " known devices, [s] searches for others")
+    
+    ''' Upload every job, jobs sharing a file and type run as one batch '''
+    async def DoJobs(self, jobs, found=None):
+        groups = {}
+        pins = {}
+        for job in jobs:
+            group = groups.setdefault((job["file"], job["type"]), [])
+            if (job["address"] not in group): group.append(job["address"])
+            if (job.get("adapter")): pins[job["address"]] = job["adapter"]
+        
+        # Known watches connect straight away, unknown ones need a scan
+        # before BlueZ connects to them
+        names = {}
+        unknown = set()
+        for job in jobs:
+            record = self.devices.Get(job["address"])
+            if (record is None):
+                unknown.add(job["address"].upper())
+            else:
+                names[job["address"]] = record.get("name", "")
+        # The scan runs on the scan adapter while known watches upload
+        scan = None
+        if (unknown):
+            def OnFound(dev):
+                if (found): found(dev)
+                if (unknown <= set(scanner.devices)): scanner.done.set()
+            scanner = Scanner(unfiltered=True, found=OnFound, adapter=self.ScanAdapter,
+                backend=self.ScanBackend)
+            scan = asyncio.ensure_future(scanner.Run())
+        
+        # Unknown watches the scan couldn't look for
+        unreachable = set()
+        async def Scanned():
+            if (scan is None): return
+            try:
+                await scan
+            except Exception:
+                unreachable.update(job["address"] for job in jobs if job["address"] not in names)
+                return
+            for job in jobs:
+                dev = scanner.devices.get(job["address"].upper())
+                names.setdefault(job["address"], dev[1] if dev else "")
+        
+        results = []
+        for (filen, kind), addresses in groups.items():
+            try:
+                if (kind == "background" and IsImage(filen)):
+                    # Converting off the loop, the scan goes on meanwhile
+                    payload = Payload(await asyncio.get_running_loop().run_in_executor(None,
+                        Convert, filen, self.Panel))
+                else:
+                    payload = Payload(filen)
+            except UploadError as e:
+                results.extend({"address": a, "type": kind, "file": filen,
+                    "error": str(e)} for a in addresses)
+                continue
+            except Exception as e:
+                results.extend({"address": a, "type": kind, "file": filen,
+                    "error": "Error opening the file: " + str(e)} for a in addresses)
+                continue
+            if (self.Check):
+                try:
+                    Validate(payload, kind == "background")
+                except UploadError as e:
+                    payload.Close()
+                    results.extend({"address": a, "type": kind, "file": filen,
+                        "error": str(e)} for a in addresses)
+                    continue
+            
+            done = {}
+            try:
+                # Known watches first, then the ones the scan found
+                for known in (True, False):
+                    if (not known): await Scanned()
+                    done.update((a, {"error": "Can't access Bluetooth."})
+                        for a in addresses if a in unreachable)
+                    part = [a for a in addresses if a not in done and (a in names or not known)]
+                    if (not part): continue
+                    batch = Batch([(a, names.get(a, ""), pins.get(a)) for a in part], payload,
+                        kind == "background", self.ProbeChunk, self.BatchLimit,
+                        self.BatchRetries, status=None if self.Json else print,
+                        session=self.session, force=self.Force, adapters=self.Adapters)
+                    done.update((await batch.Run())["results"])
+            finally:
+                payload.Close()
+            for a in addresses:
+                results.append(dict({"address": a, "type": kind, "file": filen}, **done[a]))
+        
+        await Scanned()
+        return results
+    
+    '''On jobs request, returns the exit status'''
+    def jobs_request(self, jobs):
+        results = self.Run("jobs", self.DoJobs(jobs, None if self.Json else self.OnFound))
+        self.session.Close()
+        if (self.telemetry): self.telemetry.Close()
+        
+        failed = [r for r in results if "error" in r]
+        if (self.Json):
+            print (json.dumps({"jobs": results, "done": len(results) - len(failed),
+                "failed": len(failed)}, indent=1))
+        else:
+            for result in results:
+                if ("error" in result):
+                    print (result["address"] + " [ERROR] " + result["error"])
+                else:
+                    link = FormatLink(result.get("link"))
+                    print (result["address"] + " " + result["file"] + " " + FormatRate(result["rate"]) +
+                        (" (" + link + ")" if link else ""))
+            print (str(len(results) - len(failed)) + " of " + str(len(results)) + " jobs complete.")
+        
+        return 1 if failed else 0
+    
+    '''Run a coroutine on the session, profiled with --profile'''
+    def Run(self, name, coro):
+        if (self.profiler): coro = self.profiler.Run(name, coro)
+        return self.session.Run(coro)
+    
     '''On upload request'''
     def upload_request(self):
         print ("Trying to connect to device, please wait...")
-        asyncio.run(self.DoConnect())
+        if (self.Batch):
+            self.Run("upload", self.DoBatch())
+        else:
+            self.Run("upload", self.DoConnect())
+        self.session.Close()
+        if (self.telemetry): self.telemetry.Close()
         
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="DaFup watch face and background upload tool.")
+    parser.add_argument("--probe", action="store_true",
+        help="probe chunk sizes and keep the fastest")
+    parser.add_argument("--all", action="store_true",
+        help="list every advertising device, not only MoYoung watches")
+    parser.add_argument("--count", type=int, default=0,
+        help="stop searching once this many devices were found")
+    parser.add_argument("--batch", action="store_true",
+        help="upload to several devices at once")
+    parser.add_argument("--limit", type=int, default=LIMIT,
+        help="concurrent connections per adapter in batch mode")
+    parser.add_argument("--retries", type=int, default=RETRIES,
+        help="retries per device in batch mode")
+    parser.add_argument("--force", action="store_true",
+        help="upload even if the watch already has the file")
+    parser.add_argument("--no-check", action="store_true",
+        help="upload files that don't look like faces or backgrounds")
+    parser.add_argument("--no-tune", action="store_true",
+        help="keep the connection parameters the link started with")
+    parser.add_argument("--panel", default="%dx%d" % PANEL,
+        help="watch screen size PNG and JPEG backgrounds are converted to")
+    parser.add_argument("--log",
+        help="append transfer events to this JSON-lines file")
+    parser.add_argument("--log-chunks", action="store_true",
+        help="log every chunk write too")
+    parser.add_argument("--metrics", type=int, default=0,
+        help="serve Prometheus metrics on this local port")
+    parser.add_argument("--adapter", action="append",
+        help="bluetooth adapter to upload through (e.g. hci1), may repeat, 'all' for every one")
+    parser.add_argument("--scan-adapter",
+        help="bluetooth adapter to scan with")
+    parser.add_argument("--address", action="append",
+        help="watch address to upload to without prompting, may repeat")
+    parser.add_argument("--type", choices=TYPES,
+        help="upload type of --address")
+    parser.add_argument("--file", help="file to upload to --address")
+    parser.add_argument("--jobs",
+        help="JSON file with a list of {\"address\", \"type\", \"file\"} jobs")
+    parser.add_argument("--json", action="store_true",
+        help="print the jobs report as JSON")
+    parser.add_argument("--profile", metavar="DIR",
+        help="write CPU and memory profiles of the scan and upload to DIR")
+    parser.add_argument("--sim", action="store_true",
+        help="upload to simulated watches, with a throwaway cache")
+    args = parser.parse_args()
+    try:
+        panel = ParsePanel(args.panel)
+    except ValueError as e:
+        parser.error(str(e))
+    
+    jobs = []
+    if (args.address or args.type or args.file):
+        if (not (args.address and args.type and args.file)):
+            parser.error("--address, --type and --file go together")
+        jobs = [{"address": a, "type": args.type, "file": args.file} for a in args.address]
+    if (args.jobs):
+        try:
+            jobs += LoadJobs(args.jobs)
+        except ValueError as e:
+            parser.error(str(e))
+    if (args.json and not jobs):
+        parser.error("--json needs --address or --jobs")
+    
+    # The simulated watches never reach the real cache
+    if (args.sim):
+        from DaFsim import Sandbox
+        Sandbox()
     dafup = DaFup()
+    if (args.sim):
+        from DaFsim import SimClient, SimScanner
+        dafup.session.client = SimClient
+        dafup.ScanBackend = SimScanner
+    if (args.profile):
+        from DaFprofile import Profiler
+        dafup.profiler = Profiler(args.profile)
+    dafup.ProbeChunk = args.probe
+    dafup.ScanAll = args.all
+    dafup.ScanCount = args.count
+    dafup.Batch = args.batch
+    dafup.BatchLimit = args.limit
+    dafup.BatchRetries = args.retries
+    dafup.Json = args.json
+    dafup.Force = args.force
+    dafup.Check = not args.no_check
+    dafup.Panel = panel
+    dafup.session.tune = not args.no_tune
+    if (args.adapter):
+        dafup.Adapters = Adapters() if "all" in args.adapter else args.adapter
+    dafup.ScanAdapter = args.scan_adapter
+    if (args.log or args.metrics):
+        dafup.telemetry = dafup.session.telemetry = Telemetry(args.log, args.log_chunks)
+        if (args.metrics): dafup.telemetry.Serve(args.metrics)
+    if (jobs):
+        sys.exit(dafup.jobs_request(jobs))
     dafup.main()
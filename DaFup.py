@@ -21,34 +21,61 @@
     along with this program.  If not, see <https://www.gnu.org/licenses/>.
 '''
 
+import os
+import time
+import asyncio
+import argparse
 import gi
 gi.require_version('Gtk', '3.0')
-from gi.repository import Gtk
+from gi.repository import Gtk, GLib, Gio, GdkPixbuf
 
-import asyncio
-from bleak import BleakScanner, BleakClient
-from bleak.backends.characteristic import BleakGATTCharacteristic
-from bleak.uuids import normalize_uuid_16
 import threading
-
-
-''' Main characteristic uuids '''
-CTRCHAR = normalize_uuid_16(0xfee2) # Write (no response)
-SNDCHAR = normalize_uuid_16(0xfee6) # Send data
-NTYCHAR = normalize_uuid_16(0xfee3) # Notify
-MANCHAR = normalize_uuid_16(0x2a29) # Manufacturer name
+from DaFcore import Payload, Upload, UploadError, FormatRate
+from DaFsession import Session
+from DaFcache import Devices, Checkpoints, Assets
+from DaFscan import Scanner
+from DaFbatch import Batch
+from DaFevents import Channel
+from DaFformat import Validate, Plan, FormatPlan
+from DaFimage import IsImage, Convert
+from DaFlink import FormatLink
 
 
 ''' Main Window '''
 class MainWindow:
     
-    def __init__(self):
+    def __init__(self, client=None, scanner=None, profiler=None):
         self.SetMainWindow()
         self.SetWidgets()
         self.ConnectSignals()
         self.DevSelected = ""
+        self.DevName = ""
+        self.DevBatch = []
         self.FileSelected = ""
-        self.NotifyData = ""
+        self.Background = False
+        self.Probe = False
+        self.Force = False
+        self.Check = True
+        self.ScanAll = False
+        self.warming = None
+        self.library = None
+        self.monitor = None
+        self.relist = None
+        self.ScanBackend = scanner
+        self.profiler = profiler
+        self.devices = Devices()
+        self.session = Session(devices=self.devices, checkpoints=Checkpoints(),
+            assets=Assets(), client=client)
+        # Worker threads reach the widgets through the event channel only
+        self.events = Channel(GLib.idle_add, GLib.timeout_add, self.OnProgress,
+            self.UpdateStatus, self.OnFound)
+        
+        # Known watches connect without a scan
+        for dev in self.devices.Known():
+            self.liststore.append(dev)
+        
+        # bleak loads once the window is drawn
+        self.firstframe = self.window.connect("draw", self.OnFirstFrame)
         
     '''Set main window'''
     def SetMainWindow(self):
@@ -64,6 +91,16 @@ class MainWindow:
         self.filemenu = Gtk.Menu()
         self.msearch = Gtk.MenuItem.new_with_label("Search")
         self.filemenu.append(self.msearch)
+        self.mlibrary = Gtk.MenuItem.new_with_label("Library")
+        self.filemenu.append(self.mlibrary)
+        self.mprobe = Gtk.CheckMenuItem.new_with_label("Probe chunk size")
+        self.filemenu.append(self.mprobe)
+        self.mscanall = Gtk.CheckMenuItem.new_with_label("Show all devices")
+        self.filemenu.append(self.mscanall)
+        self.mforce = Gtk.CheckMenuItem.new_with_label("Upload files already on the watch")
+        self.filemenu.append(self.mforce)
+        self.mnocheck = Gtk.CheckMenuItem.new_with_label("Skip file checks")
+        self.filemenu.append(self.mnocheck)
         self.mexit = Gtk.MenuItem.new_with_label("Exit")
         self.filemenu.append(self.mexit)
         self.filemenu.show_all()
@@ -87,6 +124,7 @@ class MainWindow:
         ### Treeview ###
         self.treeview = Gtk.TreeView(model=self.liststore)
         self.treeview_select = self.treeview.get_selection()
+        self.treeview_select.set_mode(Gtk.SelectionMode.MULTIPLE)
         self.treeview.show()
         
         ### Column Mac address ###
@@ -177,8 +215,9 @@ class MainWindow:
         self.window.connect("destroy", self.QuitMain)
         
         #Menu signals
-        self.mexit.connect("activate", Gtk.main_quit)
+        self.mexit.connect("activate", self.QuitMain)
         self.msearch.connect("activate", self.on_search_button)        
+        self.mlibrary.connect("activate", self.on_library)
         
         #Button signals
         self.upbutton.connect("clicked", self.on_upbutton_button)
@@ -192,230 +231,380 @@ class MainWindow:
     def main(self):
         Gtk.main()
 
+    '''Window drawn for the first time'''
+    def OnFirstFrame(self, widget, cr):
+        self.window.disconnect(self.firstframe)
+        self.session.Preload()
+        # Startup benchmark, report the time to first frame and quit
+        if (os.environ.get("DAFUP_STARTUP")):
+            print ("first frame %.6f" % (time.time() - float(os.environ["DAFUP_STARTUP"])), flush=True)
+            GLib.idle_add(self.QuitMain, None)
+        return False
+
     '''On quit'''
     def QuitMain(self, arg1):
+        self.Cool()
+        if (self.library): self.library.Close()
+        self.session.Close()
         Gtk.main_quit()
     
     ''' Discover bluetooth devices '''
-    async def Discover(self):
-        #Scanning for 5 seconds...
-        devices = await BleakScanner.discover(
-        return_adv=True)
-        
-        return devices
+    async def Discover(self, found=None):
+        # Scanning for up to 5 seconds, devices are reported as found
+        scanner = Scanner(unfiltered=self.ScanAll,
+            known=[dev[0] for dev in self.devices.Known()], found=found,
+            backend=self.ScanBackend)
+        return await scanner.Run()
 
     ''' Connect to device '''
     async def DoConnect(self):
-        # Main connection
-        client = BleakClient(self.DevSelected)
-        try:
-            await client.connect()
-        except Exception:
-            self.UpdateStatus("[ERROR] Can't connect to device.")
-            self.upbutton.set_sensitive(True)
+        # Open the file to send, images convert off the session loop
+        payload = await asyncio.get_running_loop().run_in_executor(None,
+            self.OpenFile, self.FileSelected)
+        if (payload is None):
+            self.events.Call(self.upbutton.set_sensitive, True)
             return
-        
-        # Check if device has a moyoung manufacturer characteristic
+            
+        self.events.Call(self.ResetProgress)
+        record = self.devices.Get(self.DevSelected) or {}
+        self.events.Status(FormatPlan(Plan(payload, record.get("chunk"), record.get("rate"))))
+        upload = Upload(self.DevSelected, payload, self.Background,
+            self.DevName, self.Probe, self.events.Progress, self.events.Status,
+            force=self.Force)
         try:
-            manfact = await client.read_gatt_char(MANCHAR)
-        except Exception:
-            self.UpdateStatus("[ERROR] It doesn't look a MOYOUNG-V2 compatible device.")
+            summary = await self.session.Upload(upload)
+        except UploadError as e:
+            self.events.Status("[ERROR] " + str(e))
             return
-        
-         # Check if device manufacturer characteristic reads as a moyoung
-        if (manfact.decode("utf-8") != "MOYOUNG-V2"):
-            await client.disconnect()
-            self.UpdateStatus("[ERROR] It doesn't look a MOYOUNG-V2 compatible device.")
+        except Exception as e:
+            self.events.Status("[ERROR] Upload failed: " + str(e))
             return
+        finally:
+            payload.Close()
+            self.events.Call(self.upbutton.set_sensitive, True)
             
-        # Start notify system, self.callback() handle it
-        await client.start_notify(NTYCHAR, self.callback)
-            
-        # Open the file to send
-        try:
-            fsize, flist = self.OpenFile(self.FileSelected)
-        except Exception:
+        if (summary["skipped"]):
+            self.events.Status("Already on the watch, applied without a transfer.")
             return
+        link = FormatLink(summary["link"])
+        self.events.Status("Transfer complete, " + FormatRate(summary["rate"]) +
+        " with " + str(summary["chunk"]) + " bytes chunks" + (", " + link if link else "") +
+        (", checksum verified." if summary["verified"] else
+         ", checksum didn't match." if summary["verified"] is False else "."))
+    
+    ''' Upload to all selected devices '''
+    async def DoBatch(self):
+        # Images convert off the session loop
+        payload = await asyncio.get_running_loop().run_in_executor(None,
+            self.OpenFile, self.FileSelected)
+        if (payload is None):
+            self.events.Call(self.upbutton.set_sensitive, True)
+            return
+        
+        self.events.Call(self.ResetProgress)
+        batch = Batch(self.DevBatch, payload, self.Background, self.Probe,
+            progress=self.events.Progress, status=self.events.Status,
+            session=self.session, force=self.Force)
+        try:
+            report = await batch.Run()
+        finally:
+            payload.Close()
+            self.events.Call(self.upbutton.set_sensitive, True)
+        
+        self.events.Status("Batch complete, " + str(report["done"]) + " of " +
+        str(report["devices"]) + " devices in " + str(report["seconds"]) + "s, " +
+        FormatRate(report["rate"]) + ".")
             
-        # Background or watch face
-        if (self.rback.get_active()):
-            cmd = self.cmdSendBackground(fsize)
-        else:
-            cmd = self.cmdSendFace(fsize)
-        # Send start transfer command
-        await client.write_gatt_char(CTRCHAR, cmd, response=False)
-        await asyncio.sleep(0.5)
-            
-        self.UpdateStatus("Transferring...")
-        self.progress.set_fraction(0)
-        # Start transfer, while not get "feea200974ff"
-        while (self.NotifyData[0:6] != b"\xfe\xea\x20\x09\x74\xff"):
-            for i in range(0, len(flist)):
-                await client.write_gatt_char(SNDCHAR, flist[i], response=False)
-                self.progress.set_fraction(self.progress.get_fraction() + (1/len(flist)))
-                await asyncio.sleep(0.3)
-            break
-            #It will break after transfer complete. Need to find out how the
-            #checksum is made to then do a proper checksum comparison.
-            
-        # Send finish command
-        # Background or watch face
-        if (self.rback.get_active()):
-            cmd = self.cmdBackTransferFinish()
-            await client.write_gatt_char(CTRCHAR, cmd, response=False)
-            cmd = self.cmdSetBackTransfer()
-            await client.write_gatt_char(CTRCHAR, cmd, response=False)
-            cmd = self.cmdSetFace(1)
-            await client.write_gatt_char(CTRCHAR, cmd, response=False)
-        else:
-            cmd = self.cmdFaceTransferFinish()
-            await client.write_gatt_char(CTRCHAR, cmd, response=False)
-            cmd = self.cmdSetFaceTransfer()
-            await client.write_gatt_char(CTRCHAR, cmd, response=False)
-            cmd = self.cmdSetFace(6)
-            await client.write_gatt_char(CTRCHAR, cmd, response=False)
-            
-        await client.disconnect()
-        self.upbutton.set_sensitive(True)
-        self.UpdateStatus("Transfer complete.")
-            
-    ''' Function that handles service characteristic notification '''
-    def callback(self, sender: BleakGATTCharacteristic, data: bytearray):
-        self.NotifyData = data        
+    ''' Transfer progress, fraction done and its text '''
+    def OnProgress(self, fraction, text):
+        self.progress.set_fraction(fraction)
+        self.progress.set_text(text)
+    
+    ''' Clear the progress bar before a transfer '''
+    def ResetProgress(self):
+        self.events.Reset()
+        self.OnProgress(0, "")
     
     ''' Update status bar '''
     def UpdateStatus(self, text="test"):
         self.statusb.push(0, text)
     
-    ''' Open a file for send '''
+    ''' Open and check a file for send '''
     def OpenFile(self, filen=""):
         if (filen == ""): return
-        # Open and divide the file in chunks
+        # Images become backgrounds of the watch format
+        if (self.Background and IsImage(filen)):
+            try:
+                filen = Convert(filen)
+            except UploadError as e:
+                self.events.Status("[ERROR] " + str(e))
+                return
+        # Map the file, the transfer reads it in chunks
         try:
-            fo = open(filen, "rb")
+            payload = Payload(filen)
         except Exception:
-            self.UpdateStatus("[ERROR] Opening file.")
+            self.events.Status("[ERROR] Opening file.")
             return
-            
-        chunk = 512
-        flist = []
-        while (True):
-            data = fo.read(chunk)
-            if (data == b''): break
-            flist.append(data)
+        
+        if (self.Check):
+            try:
+                Validate(payload, self.Background)
+            except UploadError as e:
+                payload.Close()
+                self.events.Status("[ERROR] " + str(e))
+                return
 
-        fo.seek(0,0)
-        fsize = len(fo.read())
-        fo.close()
-    
-        return fsize, flist
-    
-    ''' Face transfer cmd '''
-    def cmdSendFace(self, length=0):
-        header  = bytes.fromhex("feea200974")
-        length  = length.to_bytes(4)
-    
-        cmd = (header + length)
-        return cmd
-    
-    ''' Face transfer finish signal cmd '''
-    def cmdFaceTransferFinish(self):
-        header  = bytes.fromhex("feea20097400000000")
-    
-        cmd = header
-        return cmd
-    
-    ''' Set face transfer cmd (unknown yet) '''
-    def cmdSetFaceTransfer(self):
-        header  = bytes.fromhex("feea200ab41130040000")
-    
-        cmd = header
-        return cmd
-    
-    ''' Background transfer cmd '''
-    def cmdSendBackground(self, length=0):
-        header  = bytes.fromhex("feea20096e")
-        length  = length.to_bytes(4)
+        return payload
     
-        cmd = (header + length)
-        return cmd
-    
-    ''' Background transfer finish signal cmd '''
-    def cmdBackTransferFinish(self):
-        header  = bytes.fromhex("feea20096e00000000")
-    
-        cmd = header
-        return cmd
-    
-    ''' Set background transfer cmd (unknown yet) '''
-    def cmdSetBackTransfer(self):
-        header  = bytes.fromhex("feea200529")
-    
-        cmd = header
-        return cmd
-    
-    ''' Set watch face '''
-    def cmdSetFace(self, face=0):
-        if (face > 6): return 0
-    
-        header  = bytes.fromhex("feea200619")
-        face    = face.to_bytes(1)
-    
-        cmd = (header + face)
-        return cmd
-        
     '''On search button press'''
     def on_search_button(self, arg1):
         self.UpdateStatus("Searching for devices, please wait...")
+        self.liststore.clear()
+        self.ScanAll = self.mscanall.get_active()
         thread = threading.Thread(target=self.search_button)
         thread.daemon = True
         thread.start()
         
     '''On search button func call'''
     def search_button(self):
-        self.liststore.clear()
-        i = 0
         try:
-            devices = asyncio.run(self.Discover())
+            devices = self.Run("scan", self.Discover(self.events.Found))
         except Exception:
-            self.UpdateStatus("[ERROR] Can't access Bluetooth.")
+            self.events.Status("[ERROR] Can't access Bluetooth.")
             return
             
-        for x in devices:
-            devlist = str(devices[x][0]).split(': ')
-            self.liststore.append([devlist[0], devlist[1]])
-            i += 1
+        for dev in devices:
+            self.devices.Update(dev[0], name=dev[1], rssi=dev[2])
         
-        self.UpdateStatus("Scan complete, " + str(i) + " devices found")
+        # Strongest signal first
+        self.events.Call(self.ListDevices, devices)
+        self.events.Status("Scan complete, " + str(len(devices)) + " devices found")
+    
+    '''List scanned devices'''
+    def ListDevices(self, devices):
+        self.liststore.clear()
+        for dev in devices:
+            self.liststore.append([dev[0], dev[1]])
+    
+    '''Device found while searching'''
+    def OnFound(self, dev):
+        self.liststore.append([dev[0], dev[1]])
+    
+    ''' Connect the selected watch ahead of the upload '''
+    def Warm(self, address):
+        if (self.warming and self.warming[0] == address): return
+        self.Cool()
+        future = self.session.Submit(self.session.Warm(address))
+        future.add_done_callback(lambda f: self.OnWarm(address, f))
+        self.warming = (address, future)
+    
+    ''' Give up the speculative connection '''
+    def Cool(self):
+        if (self.warming is None): return
+        address, future = self.warming
+        self.warming = None
+        future.cancel()
+        self.session.Submit(self.session.Cool(address))
+    
+    ''' Speculative connection done, runs on the session thread '''
+    def OnWarm(self, address, future):
+        if (future.cancelled() or future.exception() is not None): return
+        self.events.Status("Connected to " + address + ", ready to upload.")
     
     '''On button upload'''
     def on_upbutton_button(self, button):
-        thread = threading.Thread(target=self.upbutton_button)
+        # Widget state is read here, the worker thread never touches widgets
+        self.upbutton.set_sensitive(False)
+        # The upload takes over the speculative connection
+        self.warming = None
+        self.Background = self.rback.get_active()
+        self.Probe = self.mprobe.get_active()
+        self.Force = self.mforce.get_active()
+        self.Check = not self.mnocheck.get_active()
+        # The UI thread is profiled too, its redraws compete with the link
+        ui = self.profiler.Begin("ui") if self.profiler else None
+        thread = threading.Thread(target=self.upbutton_button, args=(ui,))
         thread.daemon = True
         thread.start()
     
     '''On button upload func call'''
-    def upbutton_button(self):
-        self.upbutton.set_sensitive(False)
-        self.UpdateStatus("Trying to connect to device, please wait...")
+    def upbutton_button(self, ui=None):
+        self.events.Status("Trying to connect to device, please wait...")
         if (self.FileSelected == ""):
-            self.UpdateStatus("[ERROR] No file selected.")
-            return
-        asyncio.run(self.DoConnect())
+            self.events.Status("[ERROR] No file selected.")
+            self.events.Call(self.upbutton.set_sensitive, True)
+        elif (len(self.DevBatch) > 1):
+            self.Run("upload", self.DoBatch())
+        else:
+            self.Run("upload", self.DoConnect())
+        if (ui): self.events.Call(self.profiler.End, ui)
+    
+    '''Run a coroutine on the session, profiled with --profile'''
+    def Run(self, name, coro):
+        if (self.profiler): coro = self.profiler.Run(name, coro)
+        return self.session.Run(coro)
         
     '''Chosen file'''
     def FileChanged(self, chosenfile):
-        self.FileSelected = chosenfile.get_filename()
+        self.SelectFile(chosenfile.get_filename())
+    
+    '''Use a file for the next upload'''
+    def SelectFile(self, filen):
+        self.FileSelected = filen
+        
+        # Bad files are turned down before connecting
+        self.Background = self.rback.get_active()
+        self.Check = not self.mnocheck.get_active()
+        # Images are converted away from the UI thread
+        thread = threading.Thread(target=self.CheckFile, args=(filen,))
+        thread.daemon = True
+        thread.start()
+    
+    '''Check a chosen file and show its transfer plan, worker thread'''
+    def CheckFile(self, filen):
+        payload = self.OpenFile(filen)
+        if (payload is None): return
+        record = self.devices.Get(self.DevSelected) or {}
+        self.events.Status(FormatPlan(Plan(payload, record.get("chunk"), record.get("rate"))))
+        payload.Close()
+    
+    '''On library menu'''
+    def on_library(self, arg1):
+        dialog = Gtk.FileChooserDialog(title="Library folder", parent=self.window,
+            action=Gtk.FileChooserAction.SELECT_FOLDER)
+        dialog.add_buttons(Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL,
+            Gtk.STOCK_OPEN, Gtk.ResponseType.OK)
+        if (self.library): dialog.set_current_folder(self.library.directory)
+        if (dialog.run() == Gtk.ResponseType.OK):
+            self.OpenLibrary(dialog.get_filename())
+        dialog.destroy()
+    
+    '''Show the faces and backgrounds of a folder'''
+    def OpenLibrary(self, directory):
+        from DaFlibrary import Library, THUMB
+        if (self.library): self.library.Close()
+        self.library = Library(directory)
+        
+        if (not hasattr(self, "libwindow")):
+            # Thumbnail, label, path, type
+            self.libstore = Gtk.ListStore(GdkPixbuf.Pixbuf, str, str, str)
+            self.libview = Gtk.IconView(model=self.libstore)
+            self.libview.set_pixbuf_column(0)
+            self.libview.set_text_column(1)
+            self.libview.set_item_width(THUMB + 16)
+            self.libview.connect("item-activated", self.on_library_item)
+            self.libscroll = Gtk.ScrolledWindow()
+            self.libscroll.add(self.libview)
+            self.libwindow = Gtk.Window(title="Library")
+            self.libwindow.set_transient_for(self.window)
+            self.libwindow.set_default_size(640, 480)
+            self.libwindow.add(self.libscroll)
+            self.libwindow.connect("delete-event", lambda w, e: w.hide_on_delete())
+            self.libblank = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, False, 8, THUMB, THUMB)
+            self.libblank.fill(0x202020ff)
+        self.libstore.clear()
+        # Path: (row, sha256)
+        self.librows = {}
+        self.libwindow.set_title("Library - " + directory)
+        self.libwindow.show_all()
+        
+        # Files added, changed or removed refresh the library
+        if (self.monitor): self.monitor.cancel()
+        self.monitor = Gio.File.new_for_path(directory).monitor_directory(
+            Gio.FileMonitorFlags.NONE, None)
+        self.monitor.connect("changed", self.on_library_changed)
+        self.RefreshLibrary()
+    
+    '''Index the library folder away from the UI thread'''
+    def RefreshLibrary(self):
+        self.relist = None
+        library = self.library
+        def Refresh():
+            try:
+                entries = library.Refresh()
+            except Exception as e:
+                # Closed meanwhile, another folder or quitting
+                if (library.closed): return
+                self.events.Status("[ERROR] Reading the library: " + str(e))
+                return
+            self.events.Call(self.ListLibrary, library, entries)
+        thread = threading.Thread(target=Refresh)
+        thread.daemon = True
+        thread.start()
+        return False
+    
+    '''Library folder changed, refresh once the changes settle'''
+    def on_library_changed(self, monitor, changed, other, event):
+        if (self.relist): GLib.source_remove(self.relist)
+        self.relist = GLib.timeout_add(500, self.RefreshLibrary)
+    
+    '''List the library entries, thumbnails follow as they are rendered'''
+    def ListLibrary(self, library, entries):
+        if (library is not self.library): return
+        paths = {entry["path"] for entry in entries}
+        for path in [p for p in self.librows if p not in paths]:
+            self.libstore.remove(self.librows.pop(path)[0])
+        for entry in entries:
+            row, digest = self.librows.get(entry["path"], (None, None))
+            if (digest == entry["sha256"]): continue
+            label = "%s\n%s %dx%d" % (os.path.basename(entry["path"]), entry["type"].title(),
+                entry["width"], entry["height"])
+            if (row is None):
+                row = self.libstore.append([self.libblank, label, entry["path"], entry["type"]])
+            else:
+                self.libstore.set(row, [1, 3], [label, entry["type"]])
+            self.librows[entry["path"]] = (row, entry["sha256"])
+            library.Thumbnail(entry, lambda entry, thumb: self.events.Call(self.OnThumbnail,
+                library, entry, thumb))
+        self.events.Status("Library: " + str(len(entries)) + " faces and backgrounds.")
+    
+    '''Thumbnail rendered'''
+    def OnThumbnail(self, library, entry, thumb):
+        row, digest = self.librows.get(entry["path"], (None, None))
+        if (library is not self.library or digest != entry["sha256"]): return
+        width, height, rgb = thumb
+        self.libstore[row][0] = GdkPixbuf.Pixbuf.new_from_bytes(GLib.Bytes.new(rgb),
+            GdkPixbuf.Colorspace.RGB, False, 8, width, height, width * 3)
+    
+    '''Library item chosen for the next upload'''
+    def on_library_item(self, view, path):
+        filen, kind = self.libstore[path][2], self.libstore[path][3]
+        self.rback.set_active(kind == "background")
+        self.rface.set_active(kind == "face")
+        self.fbutton.set_filename(filen)
+        self.SelectFile(filen)
     
     '''On tree view selection'''
     def on_tree_selection(self, selection):
-        model, treeiter = selection.get_selected()
-        if treeiter is not None:
-            self.DevSelected = model[treeiter][0]
+        model, paths = selection.get_selected_rows()
+        self.DevBatch = [(model[path][0], model[path][1]) for path in paths]
+        if (self.DevBatch):
+            self.DevSelected, self.DevName = self.DevBatch[0]
+        
+        # One watch selected, it is probably the next upload
+        if (len(self.DevBatch) == 1):
+            self.Warm(self.DevSelected)
+        else:
+            self.Cool()
         
         self.upbutton.set_sensitive(True)
 
 
 if __name__ == "__main__":
-    mWindow = MainWindow()
+    parser = argparse.ArgumentParser(description="DaFup watch face and background upload tool.")
+    parser.add_argument("--profile", metavar="DIR",
+        help="write CPU and memory profiles of the scans and uploads to DIR")
+    parser.add_argument("--sim", action="store_true",
+        help="upload to simulated watches, with a throwaway cache")
+    args = parser.parse_args()
+    
+    client = scanner = profiler = None
+    if (args.sim):
+        from DaFsim import Sandbox, SimClient, SimScanner
+        Sandbox()
+        client, scanner = SimClient, SimScanner
+    if (args.profile):
+        from DaFprofile import Profiler
+        profiler = Profiler(args.profile)
+    mWindow = MainWindow(client, scanner, profiler)
     mWindow.main()